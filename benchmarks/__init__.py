@@ -0,0 +1,9 @@
+# file: benchmarks/__init__.py
+
+"""
+Reproducible latency/throughput benchmarks for the captioning pipeline.
+
+    python -m benchmarks.run --mode stub            # any CPU box, no weights
+    python -m benchmarks.run --mode real            # needs best.pt and the BLIP adapter
+    python -m benchmarks.run --mode stub --compare benchmarks/results/<baseline>.json
+"""
@@ -0,0 +1,59 @@
+# file: benchmarks/corpus.py
+
+import io
+import json
+import random
+from typing import List, Tuple
+
+from PIL import Image, ImageDraw
+
+PROMPT_TEMPLATES = [
+    "what is the {phrase}",
+    "describe the {phrase} of this car",
+    "caption the {phrase}",
+    "is the {phrase} damaged?",
+    "{phrase} eka mokakda",
+]
+
+
+def build_prompts(vocab_path: str, count: int, seed: int = 0) -> List[str]:
+    """Prompts naming a random vocabulary phrase of vehicle_parts_2.json, plus a few generic ones."""
+    with open(vocab_path, "r") as f:
+        data = json.load(f)
+    phrases = sorted({phrase for synonyms in data.values() for phrase in synonyms})
+
+    rng = random.Random(seed)
+    prompts = []
+    for i in range(count):
+        if i % 10 == 9:
+            prompts.append("what is in this picture")  # no vocabulary match: default keywords
+        else:
+            prompts.append(rng.choice(PROMPT_TEMPLATES).format(phrase=rng.choice(phrases)))
+    return prompts
+
+
+def build_images(count: int, seed: int = 0, size: Tuple[int, int] = (1280, 720), quality: int = 90) -> List[bytes]:
+    """Synthetic JPEG frames: a gradient background with a car-like body and random shapes."""
+    rng = random.Random(seed)
+    width, height = size
+    images = []
+    for _ in range(count):
+        image = Image.new("RGB", size)
+        draw = ImageDraw.Draw(image)
+        top, bottom = [rng.randint(0, 255) for _ in range(3)], [rng.randint(0, 255) for _ in range(3)]
+        for y in range(0, height, 8):
+            t = y / height
+            draw.rectangle([0, y, width, y + 8], fill=tuple(int(a + (b - a) * t) for a, b in zip(top, bottom)))
+
+        body = [rng.randint(0, width // 4), rng.randint(height // 4, height // 2),
+                rng.randint(3 * width // 4, width), rng.randint(3 * height // 4, height)]
+        draw.rounded_rectangle(body, radius=40, fill=tuple(rng.randint(0, 255) for _ in range(3)))
+        for _ in range(rng.randint(4, 12)):
+            x, y = rng.randint(0, width), rng.randint(0, height)
+            r = rng.randint(10, 80)
+            draw.ellipse([x - r, y - r, x + r, y + r], fill=tuple(rng.randint(0, 255) for _ in range(3)))
+
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG", quality=quality)
+        images.append(buffered.getvalue())
+    return images
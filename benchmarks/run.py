@@ -0,0 +1,203 @@
+# file: benchmarks/run.py
+
+import argparse
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence
+
+from benchmarks.corpus import build_images, build_prompts
+from benchmarks.stats import compare, summarize
+
+VOCAB_PATH = "vehicle_parts_2.json"
+REAL_MODEL_PATHS = ("best.pt", "./blip-finetuned-model")
+
+
+def _git_revision() -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": None}
+
+
+def measure(fn: Callable, inputs: Sequence, warmup: int = 3, before_each: Optional[Callable] = None,
+            failed: Optional[Callable] = None, prepare: Optional[Callable] = None) -> Dict:
+    """
+    Calls fn on every input (after `warmup` untimed calls) and summarizes the
+    per-call latencies. `prepare` maps an input's arguments to the ones fn
+    gets, outside the timed region (e.g. fresh copies of inputs fn mutates).
+    """
+    for args in list(inputs)[:warmup]:
+        if before_each:
+            before_each()
+        fn(*(prepare(*args) if prepare else args))
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for args in inputs:
+        if before_each:
+            before_each()
+        if prepare:
+            args = prepare(*args)
+        call_start = time.perf_counter()
+        result = fn(*args)
+        latencies.append(time.perf_counter() - call_start)
+        if failed is not None and failed(result):
+            errors += 1
+    wall_s = time.perf_counter() - start
+
+    summary = summarize(latencies, wall_s)
+    if failed is not None:
+        summary["errors"] = errors
+    return summary
+
+
+def run_benchmarks(args) -> Dict:
+    # Imported here: MODELS_STUB/CACHE_DIR must be in the environment before config is read
+    import config
+    from logic import pipeline
+    from logic.cache import caption_cache, detection_cache
+    from logic.ingest import ingest_image
+    from models.loader import models
+    from utils import load_phrase_index
+
+    models.load_all()
+    vocab = load_phrase_index(VOCAB_PATH)
+
+    print(f"Building corpus: {args.images} images ({args.width}x{args.height}), {args.prompts} prompts, seed {args.seed}...")
+    image_bytes = build_images(args.images, seed=args.seed, size=(args.width, args.height))
+    prompts = build_prompts(VOCAB_PATH, args.prompts, seed=args.seed)
+    count = max(len(image_bytes), len(prompts)) * args.repeat
+    pairs = [(image_bytes[i % len(image_bytes)], prompts[i % len(prompts)]) for i in range(count)]
+
+    # Intermediate inputs for the per-stage runs, computed once up front
+    images = [ingest_image(data) for data in image_bytes]
+    detections = [image.to_original(models.detector.detect_objects(image.image)) for image in images]
+    keywords = [models.matcher.extract_keywords(prompt, vocab) for prompt in prompts]
+    crops = []
+    for i in range(len(images)):
+        best = models.matcher.find_best_match(keywords[i % len(keywords)], detections[i]) or detections[i][0]
+        crops.append(images[i].crop(best["box"]))
+    jpegs = [pipeline._encode_jpeg(crop) for crop in crops]
+
+    def clear_caches():
+        detection_cache.clear()
+        caption_cache.clear()
+
+    def pipeline_failed(result):
+        return "error" in result
+
+    per_image = [(i,) for i in range(len(images))] * args.repeat
+    per_prompt = [(i,) for i in range(len(prompts))] * args.repeat
+    stages = {
+        "decode": lambda: measure(ingest_image, [(data,) for data in image_bytes] * args.repeat, args.warmup),
+        "detect_objects": lambda: measure(lambda i: models.detector.detect_objects(images[i].image), per_image, args.warmup),
+        "extract_keywords": lambda: measure(lambda i: models.matcher.extract_keywords(prompts[i], vocab),
+                                            per_prompt, args.warmup),
+        "find_best_match": lambda: measure(
+            lambda i: models.matcher.find_best_match(keywords[i], detections[i % len(detections)]), per_prompt, args.warmup),
+        "generate": lambda: measure(lambda i: models.captioner.generate(crops[i]), per_image, args.warmup),
+        # Drawing is in place: every call gets its own copy of the frame, made untimed
+        "encode_annotated": lambda: measure(
+            lambda i, frame: pipeline._encode_jpeg(pipeline._draw_detections(frame, detections[i], images[i].scale)),
+            per_image, args.warmup, prepare=lambda i: (i, images[i].image.copy())),
+        "encode_cropped": lambda: measure(lambda i: pipeline._encode_jpeg(crops[i]), per_image, args.warmup),
+        "base64": lambda: measure(lambda i: base64.b64encode(jpegs[i]).decode("utf-8"), per_image, args.warmup),
+        # End to end through the micro-batchers, once with every cache miss and once fully cached
+        "run_pipeline_cold": lambda: measure(
+            lambda data, prompt: pipeline.run_pipeline(data, prompt, vocab, artifacts=args.artifacts),
+            pairs, args.warmup, before_each=clear_caches, failed=pipeline_failed),
+        "run_pipeline_cached": lambda: measure(
+            lambda data, prompt: pipeline.run_pipeline(data, prompt, vocab, artifacts=args.artifacts),
+            pairs, args.warmup, failed=pipeline_failed),
+    }
+    selected = args.stages or list(stages)
+
+    results = {}
+    for name in selected:
+        print(f"⏱️  {name}...")
+        results[name] = stages[name]()
+        stats = results[name]
+        print(f"   - {stats['throughput_per_s']:.1f}/s, p50 {stats['p50_ms']:.2f} ms, "
+              f"p95 {stats['p95_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+
+    return {
+        "mode": args.mode,
+        **_git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": {"images": args.images, "prompts": args.prompts, "repeat": args.repeat, "seed": args.seed,
+                   "image_size": [args.width, args.height], "artifacts": args.artifacts},
+        "config": {
+            "caption_backend": config.CAPTION_BACKEND,
+            "detector_cascade": config.DETECTOR_CASCADE,
+            "detector_imgsz": config.DETECTOR_IMGSZ,
+            "detect_batch_window_ms": config.DETECT_BATCH_WINDOW_MS,
+            "caption_batch_window_ms": config.CAPTION_BATCH_WINDOW_MS,
+            "stub_detect_ms": config.STUB_DETECT_MS,
+            "stub_caption_ms": config.STUB_CAPTION_MS,
+        },
+        "stages": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    stage_names = ["decode", "detect_objects", "extract_keywords", "find_best_match", "generate",
+                   "encode_annotated", "encode_cropped", "base64", "run_pipeline_cold", "run_pipeline_cached"]
+    parser = argparse.ArgumentParser(description="Benchmark the captioning pipeline and each of its stages.")
+    parser.add_argument("--mode", choices=["stub", "real"], default="stub",
+                        help="stub: weight-free stand-in models; real: the fine-tuned models.")
+    parser.add_argument("--images", type=int, default=16, help="Number of synthetic images.")
+    parser.add_argument("--prompts", type=int, default=32, help="Number of prompts generated from the vocabulary.")
+    parser.add_argument("--width", type=int, default=1920, help="Synthetic image width.")
+    parser.add_argument("--height", type=int, default=1080, help="Synthetic image height.")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the corpus per stage.")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed calls before each stage.")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed.")
+    parser.add_argument("--artifacts", choices=["none", "inline", "multipart", "lazy"], default="inline",
+                        help="Artifact mode passed to run_pipeline.")
+    parser.add_argument("--stages", nargs="+", choices=stage_names, default=None, help="Only run these stages.")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Results file (default: benchmarks/results/<time>-<commit>-<mode>.json).")
+    parser.add_argument("--compare", type=str, default=None, help="Earlier results file to compare against.")
+    args = parser.parse_args(argv)
+
+    if args.mode == "real":
+        missing = [path for path in REAL_MODEL_PATHS if not os.path.exists(path)]
+        if missing:
+            sys.exit(f"❌ Real mode needs the model weights; missing: {', '.join(missing)}. Use --mode stub.")
+    os.environ["MODELS_STUB"] = "1" if args.mode == "stub" else "0"
+    # A shared disk tier would leak results between runs and make cold timings meaningless
+    os.environ["CACHE_DIR"] = ""
+
+    report = run_benchmarks(args)
+
+    output = args.output or os.path.join(
+        "benchmarks", "results",
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['commit']}-{args.mode}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Saved results to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        print(f"\n--- Compared with {args.compare} ({baseline.get('commit')}, {baseline.get('mode')}) ---")
+        for line in compare(report["stages"], baseline.get("stages", {})):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
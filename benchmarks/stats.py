@@ -0,0 +1,45 @@
+# file: benchmarks/stats.py
+
+import math
+from typing import Dict, List
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear-interpolated percentile of `values` for q in [0, 1]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = q * (len(ordered) - 1)
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies_s: List[float], wall_s: float) -> Dict:
+    """Throughput over `wall_s` and latency percentiles (in ms) of one measured run."""
+    latencies_ms = [latency * 1000.0 for latency in latencies_s]
+    return {
+        "n": len(latencies_ms),
+        "throughput_per_s": round(len(latencies_ms) / wall_s, 3) if wall_s > 0 else 0.0,
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 0.50), 3),
+        "p95_ms": round(percentile(latencies_ms, 0.95), 3),
+        "p99_ms": round(percentile(latencies_ms, 0.99), 3),
+        "max_ms": round(max(latencies_ms), 3) if latencies_ms else 0.0,
+    }
+
+
+def compare(current: Dict[str, Dict], baseline: Dict[str, Dict], fields=("p50_ms", "p95_ms", "p99_ms")) -> List[str]:
+    """Formats the relative change of each stage's percentiles against a baseline run."""
+    lines = []
+    for stage, stats in current.items():
+        base = baseline.get(stage)
+        if base is None:
+            lines.append(f"   - {stage}: (not in baseline)")
+            continue
+        deltas = []
+        for field in fields:
+            before, after = base.get(field, 0.0), stats.get(field, 0.0)
+            change = ((after - before) / before * 100.0) if before else 0.0
+            deltas.append(f"{field} {before:.2f} -> {after:.2f} ({change:+.1f}%)")
+        lines.append(f"   - {stage}: " + ", ".join(deltas))
+    return lines
@@ -0,0 +1,147 @@
+# file: caption_export.py
+
+import argparse
+import difflib
+import json
+import os
+import statistics
+import time
+from typing import Dict, List
+
+import torch
+from PIL import Image
+from transformers import AutoProcessor
+
+from caption_generator import CaptionGenerator, ONNX_VISION_FILENAME, load_merged_model
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class _VisionEmbeds(torch.nn.Module):
+    """Wraps BLIP's vision model so the exported graph has a single tensor output."""
+    def __init__(self, vision_model: torch.nn.Module):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.vision_model(pixel_values=pixel_values)[0]
+
+
+def export_artifact(peft_model_path: str, base_model_id: str, output_dir: str,
+                    onnx: bool = False, quantize_onnx: bool = False):
+    """Writes the merged fp32 model (and optionally the ONNX vision encoder) to `output_dir`."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"Merging adapter {peft_model_path} into {base_model_id}...")
+    model = load_merged_model(peft_model_path, base_model_id).eval()
+    model.save_pretrained(output_dir, safe_serialization=True)
+    AutoProcessor.from_pretrained(peft_model_path).save_pretrained(output_dir)
+    print(f"✅ Saved merged model to {output_dir}")
+
+    if onnx:
+        onnx_path = os.path.join(output_dir, ONNX_VISION_FILENAME)
+        image_size = model.config.vision_config.image_size
+        dummy = torch.zeros(1, 3, image_size, image_size, dtype=torch.float32)
+        with torch.inference_mode():
+            torch.onnx.export(
+                _VisionEmbeds(model.vision_model), (dummy,), onnx_path,
+                input_names=["pixel_values"], output_names=["image_embeds"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                opset_version=17,
+            )
+        print(f"✅ Exported ONNX vision encoder to {onnx_path}")
+
+        if quantize_onnx:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            fp32_path = onnx_path.replace(".onnx", ".fp32.onnx")
+            os.replace(onnx_path, fp32_path)
+            quantize_dynamic(fp32_path, onnx_path, weight_type=QuantType.QInt8)
+            print(f"✅ Quantized ONNX vision encoder to int8 (fp32 graph kept at {fp32_path})")
+
+
+def _list_images(image_dir: str, limit: int) -> List[str]:
+    paths = sorted(
+        os.path.join(image_dir, name) for name in os.listdir(image_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def parity_report(peft_model_path: str, base_model_id: str, artifact_dir: str,
+                  image_dir: str, backends: List[str], limit: int = 50) -> Dict:
+    """
+    Captions the same images with the fp32 PyTorch reference and each backend,
+    and reports caption agreement and per-image latency.
+    """
+    images = [Image.open(path).convert("RGB") for path in _list_images(image_dir, limit)]
+    if not images:
+        raise FileNotFoundError(f"No images found in '{image_dir}'.")
+
+    results = {}
+    reference_captions = None
+    for backend in ["fp32"] + [b for b in backends if b != "fp32"]:
+        captioner = CaptionGenerator(peft_model_path, base_model_id, backend=backend, artifact_dir=artifact_dir)
+        captioner.generate(images[0])  # warm-up
+
+        captions, latencies = [], []
+        for image in images:
+            start = time.perf_counter()
+            captions.append(captioner.generate(image))
+            latencies.append((time.perf_counter() - start) * 1000.0)
+
+        if reference_captions is None:
+            reference_captions = captions
+        similarities = [
+            difflib.SequenceMatcher(None, ref, cap).ratio()
+            for ref, cap in zip(reference_captions, captions)
+        ]
+        results[backend] = {
+            "exact_match_rate": sum(ref == cap for ref, cap in zip(reference_captions, captions)) / len(captions),
+            "mean_similarity": statistics.mean(similarities),
+            "latency_ms": {
+                "mean": statistics.mean(latencies),
+                "p50": _percentile(latencies, 0.50),
+                "p95": _percentile(latencies, 0.95),
+            },
+            "mismatches": [
+                {"reference": ref, "caption": cap}
+                for ref, cap in zip(reference_captions, captions) if ref != cap
+            ][:10],
+        }
+        del captioner
+
+    return {"reference": "fp32", "num_images": len(images), "backends": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the BLIP+LoRA captioner for CPU inference.")
+    parser.add_argument("--adapter", type=str, default="./blip-finetuned-model", help="Path to the fine-tuned adapter.")
+    parser.add_argument("--base-model", type=str, default="Salesforce/blip-image-captioning-base", help="Base model ID.")
+    parser.add_argument("--output", type=str, default="./blip-cpu-artifact", help="Directory to write the artifact to.")
+    parser.add_argument("--onnx", action="store_true", help="Also export the vision encoder to ONNX.")
+    parser.add_argument("--quantize-onnx", action="store_true", help="Quantize the exported ONNX graph to int8.")
+    parser.add_argument("--report-images", type=str, default=None, help="Directory of images for the parity/latency report.")
+    parser.add_argument("--report-limit", type=int, default=50, help="Maximum number of images in the report.")
+
+    args = parser.parse_args()
+
+    export_artifact(args.adapter, args.base_model, args.output, onnx=args.onnx, quantize_onnx=args.quantize_onnx)
+
+    if args.report_images:
+        backends = ["fp32", "int8"] + (["onnx"] if args.onnx else [])
+        report = parity_report(args.adapter, args.base_model, args.output, args.report_images, backends, args.report_limit)
+        report_path = os.path.join(args.output, "parity_report.json")
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+        print("\n--- Parity Report (vs. fp32 PyTorch) ---")
+        for backend, stats in report["backends"].items():
+            print(f"   - {backend}: exact match {stats['exact_match_rate']:.0%}, "
+                  f"similarity {stats['mean_similarity']:.3f}, p50 {stats['latency_ms']['p50']:.0f} ms")
+        print(f"✅ Saved report to {report_path}")
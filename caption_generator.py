@@ -56,34 +56,220 @@
 #         return generated_text
 # file: caption_generator.py (Updated to return only the first sentence)
 
+import logging
+import os
 import torch
 from PIL import Image
-from transformers import AutoProcessor, BlipForConditionalGeneration, BitsAndBytesConfig
+from threading import Thread
+from typing import Iterator, List
+from transformers import (AutoProcessor, BlipForConditionalGeneration, BitsAndBytesConfig,
+                          StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer)
 from peft import PeftModel
 
+logger = logging.getLogger(__name__)
+
+# Selectable inference backends. "4bit" is the original bitsandbytes CUDA path;
+# the others run on CPU from the merged (adapter folded in) weights.
+BACKENDS = ("4bit", "fp32", "int8", "onnx")
+ONNX_VISION_FILENAME = "vision_encoder.onnx"
+# Captions are cut at the second comma; only the first two clauses are kept.
+KEPT_CLAUSES = 2
+
+
+def resolve_backend(backend: str) -> str:
+    """Maps "auto" to 4-bit on CUDA machines and fp32 everywhere else."""
+    if backend == "auto":
+        return "4bit" if torch.cuda.is_available() else "fp32"
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown caption backend '{backend}'. Choose one of: auto, {', '.join(BACKENDS)}.")
+    return backend
+
+
+def load_merged_model(peft_model_path: str, base_model_id: str) -> BlipForConditionalGeneration:
+    """Loads the fp32 base model and folds the LoRA adapter into its weights."""
+    base_model = BlipForConditionalGeneration.from_pretrained(base_model_id, torch_dtype=torch.float32, use_safetensors=True)
+    return PeftModel.from_pretrained(base_model, peft_model_path).merge_and_unload()
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Dynamic int8 quantization of every Linear layer (weights int8, activations quantized on the fly)."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxVisionEncoder(torch.nn.Module):
+    """
+    Drop-in replacement for BLIP's vision_model that runs an exported ONNX graph
+    with ONNX Runtime. BLIP's generate() only reads the first output (the image
+    embeddings), so the text decoder keeps running in PyTorch unchanged.
+    """
+    def __init__(self, onnx_path: str, num_threads: int = 0):
+        super().__init__()
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    def forward(self, pixel_values: torch.Tensor = None, **kwargs):
+        (image_embeds,) = self.session.run(None, {"pixel_values": pixel_values.detach().cpu().numpy().astype("float32")})
+        return (torch.from_numpy(image_embeds),)
+
+
+class ClauseStoppingCriteria(StoppingCriteria):
+    """
+    Stops each sequence once it has produced `max_commas` comma tokens, i.e. as
+    soon as the span kept by the caption post-processing is complete.
+    """
+    def __init__(self, tokenizer, max_commas: int = KEPT_CLAUSES):
+        self.max_commas = max_commas
+        self.comma_ids = torch.tensor([i for token, i in tokenizer.get_vocab().items() if ',' in token])
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        comma_ids = self.comma_ids.to(input_ids.device)
+        return torch.isin(input_ids, comma_ids).sum(dim=1) >= self.max_commas
+
+
 class CaptionGenerator:
-    def __init__(self, peft_model_path: str, base_model_id: str = "Salesforce/blip-image-captioning-base"):
-        print(f"Loading captioning model from adapter: {peft_model_path}...")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.processor = AutoProcessor.from_pretrained(peft_model_path)
-        bnb_config = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_quant_type="nf4", bnb_4bit_compute_dtype=torch.float16)
-        base_model = BlipForConditionalGeneration.from_pretrained(base_model_id, quantization_config=bnb_config, device_map={"": 0}, use_safetensors=True)
-        self.model = PeftModel.from_pretrained(base_model, peft_model_path)
+    def __init__(self, peft_model_path: str, base_model_id: str = "Salesforce/blip-image-captioning-base",
+                 backend: str = "auto", artifact_dir: str | None = None, num_threads: int = 0,
+                 max_new_tokens: int = 50, early_stop: bool = True):
+        """
+        Loads the BLIP captioner on the selected backend.
+
+        CPU backends load the merged model from `artifact_dir` when it was
+        exported there (see caption_export.py), otherwise they merge the adapter
+        at startup. The "onnx" backend requires an exported artifact.
+
+        With `early_stop`, decoding ends at the second comma instead of running
+        to `max_new_tokens`, since everything after it is discarded anyway.
+        """
+        self.backend = resolve_backend(backend)
+        self.max_new_tokens = max_new_tokens
+        self.early_stop = early_stop
+        print(f"Loading captioning model from adapter: {peft_model_path} (backend: {self.backend})...")
+
+        if self.backend == "4bit":
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.dtype = torch.float16
+            self.processor_path = peft_model_path
+            self.processor = AutoProcessor.from_pretrained(peft_model_path)
+            bnb_config = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_quant_type="nf4", bnb_4bit_compute_dtype=torch.float16)
+            base_model = BlipForConditionalGeneration.from_pretrained(base_model_id, quantization_config=bnb_config, device_map={"": 0}, use_safetensors=True)
+            self.model = PeftModel.from_pretrained(base_model, peft_model_path)
+        else:
+            self.device = "cpu"
+            self.dtype = torch.float32
+            if num_threads:
+                torch.set_num_threads(num_threads)
+
+            has_artifact = artifact_dir is not None and os.path.exists(os.path.join(artifact_dir, "config.json"))
+            if has_artifact:
+                print(f"   - Using exported merged model from {artifact_dir}")
+                self.processor_path = artifact_dir
+                self.processor = AutoProcessor.from_pretrained(artifact_dir)
+                self.model = BlipForConditionalGeneration.from_pretrained(artifact_dir, torch_dtype=torch.float32)
+            else:
+                self.processor_path = peft_model_path
+                self.processor = AutoProcessor.from_pretrained(peft_model_path)
+                self.model = load_merged_model(peft_model_path, base_model_id)
+
+            if self.backend == "int8":
+                self.model = quantize_int8(self.model)
+            elif self.backend == "onnx":
+                onnx_path = os.path.join(artifact_dir or "", ONNX_VISION_FILENAME)
+                if not os.path.exists(onnx_path):
+                    raise FileNotFoundError(f"Could not find '{onnx_path}'. Run caption_export.py --onnx first.")
+                self.model.vision_model = OnnxVisionEncoder(onnx_path, num_threads)
+
         self.model.eval()
+        self._clause_stop = ClauseStoppingCriteria(self.processor.tokenizer)
         print("✅ Caption generator loaded successfully.")
 
+    def _generate_ids(self, inputs, **generate_kwargs) -> torch.Tensor:
+        """Runs `model.generate`, stopping at the clause boundary when early stopping is on."""
+        if self.early_stop:
+            generate_kwargs["stopping_criteria"] = StoppingCriteriaList([self._clause_stop])
+        with torch.inference_mode():
+            return self.model.generate(**inputs, max_new_tokens=self.max_new_tokens, **generate_kwargs)
+
     def generate(self, image_object: Image.Image) -> str:
         """
         Generates a caption for a given PIL Image object and returns only the first sentence.
         """
-        print("✍️  Generating caption for the cropped image...")
-        inputs = self.processor(images=image_object, return_tensors="pt").to(self.device, torch.float16)
+        return self.generate_batch([image_object])[0]
 
-        generated_ids = self.model.generate(**inputs, max_new_tokens=50)
-        full_caption = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0].strip()
+    def generate_batch(self, image_objects: List[Image.Image]) -> List[str]:
+        """
+        Generates captions for several PIL Image objects with a single batched
+        `generate` call. The processor resizes every crop to the same input size,
+        and the decoded sequences are padded, so each caller gets its own caption.
+        """
+        logger.debug("Generating captions for a batch of %d cropped image(s)...", len(image_objects))
+        pixel_values = self.processor(images=image_objects, return_tensors="pt")["pixel_values"]
+        return self.generate_from_pixels(pixel_values)
+
+    def generate_from_pixels(self, pixel_values) -> List[str]:
+        """
+        Generates captions for a (batch, 3, H, W) array of images already run
+        through the image processor, e.g. by the worker processes of a bulk run
+        (see logic/bulk.py).
+        """
+        inputs = {"pixel_values": torch.as_tensor(pixel_values).to(self.device, self.dtype)}
+        generated_ids = self._generate_ids(inputs)
+        full_captions = self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+        return [self._first_sentence(caption.strip()) for caption in full_captions]
+
+    def generate_stream(self, image_object: Image.Image) -> Iterator[str]:
+        """
+        Yields the caption of one image piece by piece as tokens are decoded.
+        The chunks join up to the same text generate() returns.
+        """
+        logger.debug("Streaming caption for the cropped image...")
+        inputs = self.processor(images=image_object, return_tensors="pt").to(self.device, self.dtype)
+        streamer = TextIteratorStreamer(self.processor.tokenizer, skip_special_tokens=True)
+        thread = Thread(target=self._generate_ids, args=(inputs,), kwargs={"streamer": streamer}, daemon=True)
+        thread.start()
+
+        commas = 0
+        started = False
+        # Trailing whitespace is held back until more text follows, so the
+        # joined chunks are stripped at both ends like _first_sentence's
+        held = ""
+        for chunk in streamer:
+            kept = []
+            for i, part in enumerate(chunk.split(',')):
+                if i > 0:
+                    # Same span as _first_sentence: drop the first comma, stop at the second
+                    commas += 1
+                    if commas >= KEPT_CLAUSES:
+                        break
+                kept.append(part)
+            text = "".join(kept)
+            if not started:
+                text = text.lstrip()
+            body = text.rstrip()
+            if body:
+                started = True
+                yield held + body
+                held = text[len(body):]
+            else:
+                held += text
+            if commas >= KEPT_CLAUSES:
+                break
+
+        # Drain the streamer so the generation thread can finish
+        for _ in streamer:
+            pass
+        thread.join()
+        yield "."
+
+    @staticmethod
+    def _first_sentence(full_caption: str) -> str:
+        # Keeps the text up to the second comma. Slicing (rather than indexing
+        # [0] and [1]) means a comma-less caption can't fail the whole batch.
+        first_sentence = "".join(full_caption.split(',')[:KEPT_CLAUSES])
 
-        
-        first_sentence = full_caption.split(',')[0]+full_caption.split(',')[1]
-        
         # Clean up any extra whitespace and add a period back.
-        return first_sentence.strip() + "."
\ No newline at end of file
+        return first_sentence.strip() + "."
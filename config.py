@@ -0,0 +1,136 @@
+# file: config.py
+
+import os
+
+# --- Micro-batching ---
+# Crops/images arriving within the window (or until the batch is full) are
+# coalesced into one model call.
+CAPTION_BATCH_MAX_SIZE = int(os.getenv("CAPTION_BATCH_MAX_SIZE", "8"))
+CAPTION_BATCH_WINDOW_MS = float(os.getenv("CAPTION_BATCH_WINDOW_MS", "10"))
+DETECT_BATCH_MAX_SIZE = int(os.getenv("DETECT_BATCH_MAX_SIZE", "4"))
+DETECT_BATCH_WINDOW_MS = float(os.getenv("DETECT_BATCH_WINDOW_MS", "5"))
+
+# --- Stub models ---
+# MODELS_STUB=1 swaps in weight-free stand-ins (models/stub.py) for benchmarks
+# and load tests; the STUB_*_MS settings add simulated per-batch model latency.
+MODELS_STUB = os.getenv("MODELS_STUB", "0") == "1"
+STUB_DETECT_MS = float(os.getenv("STUB_DETECT_MS", "0"))
+STUB_CAPTION_MS = float(os.getenv("STUB_CAPTION_MS", "0"))
+
+# --- Startup ---
+# Dummy inferences per model before the API reports ready (0 disables warm-up).
+WARMUP_RUNS = int(os.getenv("WARMUP_RUNS", "1"))
+STARTUP_TIMEOUT_S = float(os.getenv("STARTUP_TIMEOUT_S", "600"))
+
+# --- Execution pool / admission control ---
+# "thread" shares the loaded models; "process" loads them once per worker process.
+PIPELINE_POOL_KIND = os.getenv("PIPELINE_POOL_KIND", "thread")
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+# Requests allowed to wait for a worker before new ones get a 503.
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "30"))
+RETRY_AFTER_S = int(os.getenv("RETRY_AFTER_S", "1"))
+
+# --- Matching ---
+# "local" scores keywords in-process; "remote" posts them to MATCH_API_URL.
+MATCH_BACKEND = os.getenv("MATCH_BACKEND", "local")
+MATCH_API_URL = os.getenv("MATCH_API_URL", "https://374b27a6e238.ngrok-free.app/match/")
+MATCH_API_TIMEOUT_S = float(os.getenv("MATCH_API_TIMEOUT_S", "10"))
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", "4096"))
+# Prompt words no exact vocabulary match covers (and multi-word spans that only
+# hit a generic single word, like "head lamp") are snapped to the nearest
+# vocabulary phrases, using the store built by `python vocabulary_index.py`.
+VOCAB_STORE_PATH = os.getenv("VOCAB_STORE_PATH", "./vehicle_parts_2.embeddings")
+VOCAB_SNAP_THRESHOLD = float(os.getenv("VOCAB_SNAP_THRESHOLD", "0.65"))
+VOCAB_SNAP_MAX_NGRAM = int(os.getenv("VOCAB_SNAP_MAX_NGRAM", "3"))
+
+# --- Result caching ---
+DETECTION_CACHE_MAX_BYTES = int(os.getenv("DETECTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CAPTION_CACHE_MAX_BYTES = int(os.getenv("CAPTION_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Optional on-disk tier shared by worker processes; empty disables it.
+CACHE_DIR = os.getenv("CACHE_DIR", "")
+
+# --- Image ingest ---
+# Uploads over these limits get a 413; larger frames are decoded (JPEG draft
+# mode) to a working resolution whose long side is INGEST_MAX_SIDE.
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(20 * 1024 * 1024)))
+INGEST_MAX_PIXELS = int(os.getenv("INGEST_MAX_PIXELS", str(40_000_000)))
+INGEST_MAX_SIDE = int(os.getenv("INGEST_MAX_SIDE", "1280"))
+# Crops are taken from the original when the working frame has fewer pixels than this (the captioner's input size).
+CROP_MIN_SIDE = int(os.getenv("CROP_MIN_SIDE", "384"))
+
+# --- Detection ---
+# Cascade mode runs the parts model only inside detected vehicle boxes.
+DETECTOR_CASCADE = os.getenv("DETECTOR_CASCADE", "0") == "1"
+CASCADE_PARTS_IMGSZ = int(os.getenv("CASCADE_PARTS_IMGSZ", "320"))
+CASCADE_ROI_PADDING = float(os.getenv("CASCADE_ROI_PADDING", "0.05"))
+# Run only the detector model(s), and parts classes, that the prompt's keywords call for.
+DETECTION_PLANNING = os.getenv("DETECTION_PLANNING", "1") == "1"
+# Shared letterbox size for both models (multiple of 32) and cross-model NMS IoU.
+DETECTOR_IMGSZ = int(os.getenv("DETECTOR_IMGSZ", "640"))
+DETECTOR_NMS_IOU = float(os.getenv("DETECTOR_NMS_IOU", "0.6"))
+
+# --- Captioning ---
+# "auto" picks 4bit on CUDA and fp32 on CPU; also "int8" and "onnx" (CPU).
+CAPTION_BACKEND = os.getenv("CAPTION_BACKEND", "auto")
+# Merged/exported model written by caption_export.py, used by the CPU backends.
+CAPTION_ARTIFACT_DIR = os.getenv("CAPTION_ARTIFACT_DIR", "./blip-cpu-artifact")
+CAPTION_CPU_THREADS = int(os.getenv("CAPTION_CPU_THREADS", "0"))
+CAPTION_MAX_NEW_TOKENS = int(os.getenv("CAPTION_MAX_NEW_TOKENS", "50"))
+# Stop decoding at the clause boundary instead of generating tokens we discard.
+CAPTION_EARLY_STOP = os.getenv("CAPTION_EARLY_STOP", "1") == "1"
+
+# --- Caption enrichment ---
+# Top-k car model/part facts from car_corpus_dataset.json, retrieved from the
+# index built offline by `python corpus_index.py` (skipped if it isn't there).
+CORPUS_ENRICHMENT = os.getenv("CORPUS_ENRICHMENT", "1") == "1"
+CORPUS_INDEX_PATH = os.getenv("CORPUS_INDEX_PATH", "./car_corpus_index")
+CORPUS_TOP_K = int(os.getenv("CORPUS_TOP_K", "3"))
+CORPUS_MIN_SCORE = float(os.getenv("CORPUS_MIN_SCORE", "0.35"))
+# What the retrieval query is built from: "label", "caption" or "label+caption".
+CORPUS_QUERY = os.getenv("CORPUS_QUERY", "label+caption")
+
+# --- Response artifacts ---
+# Lazily rendered images stay fetchable from /artifacts/{id} for this long.
+ARTIFACT_TTL_S = float(os.getenv("ARTIFACT_TTL_S", "300"))
+ARTIFACT_MAX_ITEMS = int(os.getenv("ARTIFACT_MAX_ITEMS", "1024"))
+# Memory budget of the held artifacts: unrendered frames/crops count at their
+# decoded size, rendered ones at their JPEG size. The oldest are dropped first.
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# --- Batch captioning ---
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "256"))
+# Images processed (and streamed back) per pipeline call.
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "8"))
+
+# --- Video sessions ---
+# Frame sequences posted to /video/sessions/{id}/frames keep object tracks between frames.
+VIDEO_SESSION_TTL_S = float(os.getenv("VIDEO_SESSION_TTL_S", "120"))
+VIDEO_MAX_SESSIONS = int(os.getenv("VIDEO_MAX_SESSIONS", "256"))
+# Full detection runs at least every N frames, and sooner when the frame or a
+# track's region drifts by more than the threshold (mean absolute difference
+# of 16x16 grayscale thumbnails, 0..1).
+VIDEO_KEYFRAME_INTERVAL = int(os.getenv("VIDEO_KEYFRAME_INTERVAL", "30"))
+VIDEO_DRIFT_THRESHOLD = float(os.getenv("VIDEO_DRIFT_THRESHOLD", "0.08"))
+# A track's caption is reused until its crop differs from the captioned one by more than this.
+VIDEO_CAPTION_CHANGE = float(os.getenv("VIDEO_CAPTION_CHANGE", "0.12"))
+# Detections continue a track with the same label and at least this IoU; tracks
+# missing from more than VIDEO_TRACK_MAX_MISSES keyframes are dropped.
+VIDEO_TRACK_IOU = float(os.getenv("VIDEO_TRACK_IOU", "0.3"))
+VIDEO_TRACK_MAX_MISSES = int(os.getenv("VIDEO_TRACK_MAX_MISSES", "2"))
+
+# --- Model server ---
+# When set (a unix socket path or host:port), HTTP workers use the models of a
+# single `python -m models.remote` process instead of loading their own copy.
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "")
+# The connection is pickle-based, so the key is all that stands between a client
+# and code execution on the server. The default key is only accepted for a unix
+# socket (readable by its owner only); a host:port address needs a secret key.
+DEFAULT_MODEL_SERVER_AUTHKEY = b"captioner"
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "").encode("utf-8") or DEFAULT_MODEL_SERVER_AUTHKEY
+
+# --- Observability ---
+# Per-request/per-detection diagnostics are logged at DEBUG; the default keeps the hot path quiet.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Add a Server-Timing header with the per-stage breakdown to /caption/ responses.
+TIMING_HEADER = os.getenv("TIMING_HEADER", "1") == "1"
@@ -0,0 +1,91 @@
+# file: corpus_index.py
+
+import argparse
+import json
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+# Dataset section -> the "kind" reported with each retrieved fact
+DATASET_SECTIONS = {"car_models": "model", "car_parts": "part"}
+
+
+def corpus_rows(dataset: Dict) -> Tuple[List[Tuple[int, str]], List[str], List[Dict[str, Any]]]:
+    """
+    Flattens car_corpus_dataset.json into embedding rows. Each entry is
+    embedded by its name (plus type) and by its corpus text, so both short
+    label queries and full captions find it. Entries listed more than once
+    become one key (the first entry's facts) with all of their rows.
+    """
+    rows, keys, payloads = [], [], []
+    key_indices: Dict[str, int] = {}
+    for section, kind in DATASET_SECTIONS.items():
+        for entry in dataset.get(section, []):
+            name = entry["name"].strip()
+            key = f"{kind}:{name.lower()}"
+            index = key_indices.get(key)
+            if index is None:
+                index = key_indices[key] = len(keys)
+                keys.append(key)
+                payload = {"kind": kind, "name": name, "summary": entry.get("summary", {})}
+                if entry.get("type"):
+                    payload["type"] = entry["type"]
+                payloads.append(payload)
+
+            rows.append((index, f"{name}. {entry['type']}" if entry.get("type") else name.lower()))
+            if entry.get("corpus"):
+                rows.append((index, entry["corpus"]))
+    return rows, keys, payloads
+
+
+def build_corpus_index(dataset_path: str, output_path: str, model_name: str = "all-MiniLM-L6-v2") -> EmbeddingStore:
+    """Embeds every corpus entry with the sentence-transformer model and saves the store."""
+    from sentence_transformers import SentenceTransformer
+
+    with open(dataset_path, "r") as f:
+        dataset = json.load(f)
+    rows, keys, payloads = corpus_rows(dataset)
+
+    print(f"Embedding {len(rows)} rows for {len(keys)} corpus entries with {model_name}...")
+    model = SentenceTransformer(model_name)
+    store = EmbeddingStore.build(
+        lambda texts: model.encode(texts, convert_to_numpy=True, normalize_embeddings=True),
+        rows, keys, payloads, model_name=model_name,
+    )
+    store.save(output_path)
+    print(f"✅ Saved corpus index ({store.matrix.shape[0]} x {store.dimension}, float16) to {output_path}.*")
+    return store
+
+
+class CorpusIndex:
+    """Top-k retrieval of car model and part facts over a memory-mapped EmbeddingStore."""
+    def __init__(self, store: EmbeddingStore):
+        self.store = store
+
+    @classmethod
+    def load(cls, path: str) -> "CorpusIndex":
+        return cls(EmbeddingStore.load(path, mmap=True))
+
+    @property
+    def dimension(self) -> int:
+        return self.store.dimension
+
+    def lookup(self, query_vectors: np.ndarray, top_k: int = 3, threshold: float = 0.35) -> List[List[Dict]]:
+        """Returns, per query vector, the best matching entries' facts with their scores."""
+        return [
+            [{**self.store.payloads[i], "score": round(score, 4)} for i, score in matches]
+            for matches in self.store.search(query_vectors, top_k=top_k, threshold=threshold)
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the caption-enrichment index over car_corpus_dataset.json.")
+    parser.add_argument("--dataset", type=str, default="car_corpus_dataset.json", help="Path to the corpus dataset.")
+    parser.add_argument("--output", type=str, default="./car_corpus_index", help="Path prefix of the index files.")
+    parser.add_argument("--model", type=str, default="all-MiniLM-L6-v2", help="Sentence-transformer model (must match the matcher's).")
+
+    args = parser.parse_args()
+
+    build_corpus_index(args.dataset, args.output, args.model)
@@ -0,0 +1,111 @@
+# file: embedding_store.py
+
+import os
+import pickle
+from typing import Any, Callable, List, Sequence, Tuple
+
+import numpy as np
+
+EncodeFn = Callable[[List[str]], np.ndarray]
+
+
+class EmbeddingStore:
+    """
+    A read-only table of L2-normalized text embeddings, built offline and
+    memory-mapped at serve time.
+
+    Each key (a corpus entry, a vocabulary category, ...) owns one or more
+    rows of a float16 matrix; a query's score for a key is its best cosine
+    similarity over the key's rows. On disk the store is three files:
+      <path>.f16.npy   the (rows, dim) float16 matrix
+      <path>.ids.npy   the int32 key index of every row (rows grouped by key)
+      <path>.meta.pkl  the keys, their payloads and the encoder name
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, matrix: np.ndarray, row_keys: np.ndarray, keys: List[str],
+                 payloads: List[Any] | None = None, model_name: str = ""):
+        self.matrix = matrix
+        self.row_keys = row_keys
+        self.keys = keys
+        self.payloads = payloads if payloads is not None else [None] * len(keys)
+        self.model_name = model_name
+        # First row of every key, for the per-key max reduction
+        self._key_starts = np.flatnonzero(np.r_[True, row_keys[1:] != row_keys[:-1]]) if len(row_keys) else row_keys
+
+    @property
+    def dimension(self) -> int:
+        return self.matrix.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, encode: EncodeFn, rows: Sequence[Tuple[int, str]], keys: List[str],
+              payloads: List[Any] | None = None, model_name: str = "", batch_size: int = 256) -> "EmbeddingStore":
+        """
+        Embeds (key index, text) rows with `encode`, which must return
+        L2-normalized vectors. Every key needs at least one row.
+        """
+        rows = sorted(rows, key=lambda row: row[0])
+        if {key_index for key_index, _ in rows} != set(range(len(keys))):
+            raise ValueError("Every key needs at least one text row.")
+        texts = [text for _, text in rows]
+        chunks = [encode(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        matrix = np.vstack(chunks).astype(np.float16)
+        row_keys = np.array([key_index for key_index, _ in rows], dtype=np.int32)
+        return cls(matrix, row_keys, keys, payloads, model_name)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.save(f"{path}.f16.npy", self.matrix.astype(np.float16))
+        np.save(f"{path}.ids.npy", self.row_keys.astype(np.int32))
+        with open(f"{path}.meta.pkl", "wb") as f:
+            pickle.dump({"version": self.FORMAT_VERSION, "keys": self.keys, "payloads": self.payloads,
+                         "model_name": self.model_name}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return all(os.path.exists(f"{path}{suffix}") for suffix in (".f16.npy", ".ids.npy", ".meta.pkl"))
+
+    def in_memory(self) -> "EmbeddingStore":
+        """
+        A copy with the matrix upcast to float32 in process memory, for stores
+        searched on every request: it skips the per-search upcast of the mapped
+        float16 matrix at the cost of a private copy.
+        """
+        return EmbeddingStore(np.ascontiguousarray(self.matrix, dtype=np.float32), np.asarray(self.row_keys),
+                              self.keys, self.payloads, self.model_name)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "EmbeddingStore":
+        """Opens a saved store; with `mmap` the matrix pages are shared by every process that opens it."""
+        with open(f"{path}.meta.pkl", "rb") as f:
+            meta = pickle.load(f)
+        if meta.get("version") != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding store format: {meta.get('version')}")
+        mmap_mode = "r" if mmap else None
+        matrix = np.load(f"{path}.f16.npy", mmap_mode=mmap_mode)
+        row_keys = np.load(f"{path}.ids.npy", mmap_mode=mmap_mode)
+        return cls(matrix, row_keys, meta["keys"], meta["payloads"], meta["model_name"])
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """(queries, keys) matrix of each query's best cosine similarity per key."""
+        matrix = self.matrix if self.matrix.dtype == np.float32 else self.matrix.astype(np.float32)
+        row_scores = np.asarray(queries, dtype=np.float32) @ matrix.T
+        if len(self._key_starts) == len(self.row_keys):  # one row per key
+            return row_scores
+        return np.maximum.reduceat(row_scores, self._key_starts, axis=1)
+
+    def search(self, queries: np.ndarray, top_k: int = 3, threshold: float = 0.0) -> List[List[Tuple[int, float]]]:
+        """Returns, per query, up to `top_k` (key index, score) pairs at or above `threshold`, best first."""
+        if len(queries) == 0 or len(self.keys) == 0:
+            return [[] for _ in range(len(queries))]
+        key_scores = self.scores(queries)
+        k = min(top_k, key_scores.shape[1])
+        candidates = np.argpartition(-key_scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, columns in zip(key_scores, candidates):
+            ordered = columns[np.argsort(-row[columns])]
+            results.append([(int(i), float(row[i])) for i in ordered if row[i] >= threshold])
+        return results
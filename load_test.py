@@ -0,0 +1,248 @@
+# file: load_test.py
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.corpus import build_prompts
+from benchmarks.stats import percentile, summarize
+from test_api import get_content_type
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# Upper bounds (ms) of the printed latency histogram
+HISTOGRAM_BOUNDS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def load_corpus(image_dir: str, prompts_path: Optional[str], prompt: Optional[str],
+                vocab_path: str = "vehicle_parts_2.json") -> Tuple[List[Tuple[str, bytes, str]], List[str]]:
+    """Reads every image of `image_dir` into memory, plus the prompts to cycle through."""
+    images = []
+    for name in sorted(os.listdir(image_dir)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            path = os.path.join(image_dir, name)
+            with open(path, "rb") as f:
+                images.append((name, f.read(), get_content_type(path)))
+    if not images:
+        raise FileNotFoundError(f"No images found in '{image_dir}'.")
+
+    if prompt:
+        prompts = [prompt]
+    elif prompts_path:
+        with open(prompts_path, "r") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    else:
+        prompts = build_prompts(vocab_path, 64)
+    return images, prompts
+
+
+class LoadStats:
+    """Per-request outcomes of a run."""
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.ok_latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.response_bytes: List[int] = []
+        self.stage_timings: Dict[str, List[float]] = {}
+
+    def record(self, latency: float, status: Optional[int], size: int = 0,
+               server_timing: Optional[str] = None, error: Optional[str] = None):
+        self.latencies.append(latency)
+        if error is not None:
+            self.errors[error] += 1
+            return
+        self.statuses[status] += 1
+        self.response_bytes.append(size)
+        if status == 200:
+            self.ok_latencies.append(latency)
+        if server_timing:
+            for entry in server_timing.split(","):
+                stage, _, duration = entry.strip().partition(";dur=")
+                if duration:
+                    self.stage_timings.setdefault(stage, []).append(float(duration))
+
+    def report(self, wall_s: float, sent: int) -> Dict:
+        total = len(self.latencies)
+        failed = total - self.statuses.get(200, 0)
+        return {
+            "requests": total,
+            "scheduled": sent,
+            "wall_s": round(wall_s, 3),
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            "statuses": {str(code): count for code, count in sorted(self.statuses.items())},
+            "client_errors": dict(self.errors),
+            "latency": summarize(self.latencies, wall_s),
+            "ok_latency": summarize(self.ok_latencies, wall_s),
+            "latency_histogram_ms": self.histogram(),
+            "response_bytes": {
+                "total": sum(self.response_bytes),
+                "mean": round(sum(self.response_bytes) / len(self.response_bytes), 1) if self.response_bytes else 0.0,
+                "p95": round(percentile(self.response_bytes, 0.95), 1),
+            },
+            "server_timing_p50_ms": {
+                stage: round(percentile(values, 0.50), 3) for stage, values in sorted(self.stage_timings.items())
+            },
+        }
+
+    def histogram(self) -> Dict[str, int]:
+        counts = {f"<={bound}": 0 for bound in HISTOGRAM_BOUNDS_MS}
+        counts["+Inf"] = 0
+        for latency in self.latencies:
+            ms = latency * 1000.0
+            bucket = next((f"<={bound}" for bound in HISTOGRAM_BOUNDS_MS if ms <= bound), "+Inf")
+            counts[bucket] += 1
+        return counts
+
+
+async def send_one(client: httpx.AsyncClient, url: str, image: Tuple[str, bytes, str], prompt: str,
+                   artifacts: str, stats: LoadStats, scheduled_at: float):
+    """Posts one request. Latency counts from the scheduled send time, so client-side queueing is included."""
+    name, data, content_type = image
+    try:
+        response = await client.post(
+            url, files={"image": (name, data, content_type)}, data={"prompt": prompt}, params={"artifacts": artifacts}
+        )
+        stats.record(time.perf_counter() - scheduled_at, response.status_code, len(response.content),
+                     response.headers.get("server-timing"))
+    except httpx.TimeoutException:
+        stats.record(time.perf_counter() - scheduled_at, None, error="timeout")
+    except httpx.HTTPError as e:
+        stats.record(time.perf_counter() - scheduled_at, None, error=type(e).__name__)
+
+
+async def run_load(url: str, images, prompts, concurrency: int, rate: float, duration_s: float,
+                   artifacts: str = "none", arrival: str = "constant", timeout_s: float = 60.0, seed: int = 0) -> Dict:
+    """
+    Closed loop (rate == 0): `concurrency` clients send back to back for `duration_s`.
+    Open loop (rate > 0): requests are started at `rate` per second (evenly spaced
+    or Poisson) whatever the response times, over at most `concurrency` connections.
+    """
+    rng = random.Random(seed)
+    stats = LoadStats()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    sent = 0
+
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(timeout_s, pool=None)) as client:
+        start = time.perf_counter()
+        end = start + duration_s
+
+        if rate <= 0:
+            async def worker(offset: int):
+                nonlocal sent
+                i = offset
+                while time.perf_counter() < end:
+                    sent += 1
+                    await send_one(client, url, images[i % len(images)], prompts[i % len(prompts)],
+                                   artifacts, stats, time.perf_counter())
+                    i += concurrency
+
+            await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        else:
+            tasks = []
+            next_at = start
+            while next_at < end:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(send_one(
+                    client, url, images[sent % len(images)], prompts[sent % len(prompts)], artifacts, stats, next_at
+                )))
+                sent += 1
+                next_at += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+            await asyncio.gather(*tasks)
+
+        wall_s = time.perf_counter() - start
+
+    return stats.report(wall_s, sent)
+
+
+def start_stub_server(port: int, detect_ms: float, caption_ms: float, timeout_s: float = 60.0) -> subprocess.Popen:
+    """Starts the API with stub models on localhost and waits for /readyz."""
+    env = dict(os.environ, MODELS_STUB="1", STUB_DETECT_MS=str(detect_ms), STUB_CAPTION_MS=str(caption_ms))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"], env=env
+    )
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Stub server exited with code {process.returncode}.")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/readyz").status_code == 200:
+                print(f"✅ Stub server ready on port {port}.")
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise TimeoutError(f"Stub server was not ready within {timeout_s:.0f}s.")
+
+
+def print_report(report: Dict):
+    latency = report["latency"]
+    print(f"\n--- {report['requests']} requests in {report['wall_s']:.1f}s "
+          f"({latency['throughput_per_s']:.1f} req/s), error rate {report['error_rate']:.1%} ---")
+    print(f"   - Latency: p50 {latency['p50_ms']:.0f} ms, p95 {latency['p95_ms']:.0f} ms, "
+          f"p99 {latency['p99_ms']:.0f} ms, max {latency['max_ms']:.0f} ms")
+    print(f"   - Status codes: {report['statuses']}  Client errors: {report['client_errors'] or 'none'}")
+    print(f"   - Response size: mean {report['response_bytes']['mean']:.0f} B, p95 {report['response_bytes']['p95']:.0f} B")
+    print("   - Latency histogram (ms): " + ", ".join(f"{k}: {v}" for k, v in report["latency_histogram_ms"].items() if v))
+    if report["server_timing_p50_ms"]:
+        print("   - Server-Timing p50 (ms): " + ", ".join(f"{k} {v:.1f}" for k, v in report["server_timing_p50_ms"].items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay images and prompts against /caption/ under load.")
+    parser.add_argument("--images", type=str, required=True, help="Directory of images to replay.")
+    parser.add_argument("--prompts", type=str, default=None, help="File with one prompt per line (default: generated from the vocabulary).")
+    parser.add_argument("--prompt", type=str, default=None, help="Use this single prompt for every request.")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8000/caption/", help="URL of the API endpoint.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients (closed loop) or max connections (open loop).")
+    parser.add_argument("--rate", type=float, default=0.0, help="Open-loop arrival rate in requests/s (0: closed loop).")
+    parser.add_argument("--arrival", choices=["constant", "poisson"], default="constant", help="Open-loop inter-arrival times.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to send requests for.")
+    parser.add_argument("--artifacts", choices=["none", "inline", "multipart", "lazy"], default="none",
+                        help="Artifact mode to request.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--output", type=str, default=None, help="Write the report as JSON to this file.")
+    parser.add_argument("--stub-server", type=int, default=None, metavar="PORT",
+                        help="Start the API with stub models on this port and target it.")
+    parser.add_argument("--stub-detect-ms", type=float, default=20.0, help="Simulated detector latency of the stub server.")
+    parser.add_argument("--stub-caption-ms", type=float, default=60.0, help="Simulated captioner latency of the stub server.")
+
+    args = parser.parse_args()
+
+    images, prompts = load_corpus(args.images, args.prompts, args.prompt)
+    print(f"Loaded {len(images)} images and {len(prompts)} prompts.")
+
+    server = None
+    url = args.url
+    if args.stub_server:
+        server = start_stub_server(args.stub_server, args.stub_detect_ms, args.stub_caption_ms)
+        url = f"http://127.0.0.1:{args.stub_server}/caption/"
+
+    try:
+        mode = f"open loop at {args.rate:g} req/s ({args.arrival})" if args.rate > 0 else "closed loop"
+        print(f"🚀 Sending to {url}: {mode}, concurrency {args.concurrency}, {args.duration:g}s...")
+        report = asyncio.run(run_load(url, images, prompts, args.concurrency, args.rate, args.duration,
+                                      artifacts=args.artifacts, arrival=args.arrival, timeout_s=args.timeout))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report["config"] = {"url": url, "concurrency": args.concurrency, "rate": args.rate, "arrival": args.arrival,
+                        "duration_s": args.duration, "artifacts": args.artifacts}
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Saved report to {args.output}")
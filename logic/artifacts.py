@@ -0,0 +1,98 @@
+# file: logic/artifacts.py
+
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+# How a /caption/ response carries the annotated and cropped images.
+ARTIFACT_MODES = ("none", "inline", "multipart", "lazy")
+
+
+class ArtifactStore:
+    """
+    Holds not-yet-rendered response images for a limited time.
+
+    Each entry is a zero-argument callable returning the JPEG bytes. It is only
+    called when a client fetches the artifact, and the bytes are kept for later
+    fetches until the entry expires. Entries count against `max_bytes` with the
+    size the caller gives for what the renderer holds (see image_nbytes), and
+    with their JPEG size once rendered; the oldest entries go first.
+    """
+    def __init__(self, ttl_s: float = 300.0, max_items: int = 1024, max_bytes: int = 256 * 1024 * 1024):
+        self.ttl_s = ttl_s
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # id -> [expires_at, renderer, rendered, nbytes]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        """Drops expired and overflowing entries. Caller holds the lock."""
+        now = time.monotonic()
+        while self._entries:
+            artifact_id, (expires_at, _, _, nbytes) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_items and self._bytes <= self.max_bytes:
+                break
+            del self._entries[artifact_id]
+            self._bytes -= nbytes
+
+    def put(self, renderer: Callable[[], bytes], nbytes: int = 0) -> str:
+        artifact_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[artifact_id] = [time.monotonic() + self.ttl_s, renderer, None, nbytes]
+            self._bytes += nbytes
+            self._expire()
+        return artifact_id
+
+    def get(self, artifact_id: str) -> Optional[bytes]:
+        """Returns the rendered artifact, rendering it on first access, or None if unknown/expired."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(artifact_id)
+            if entry is None:
+                return None
+            _, renderer, rendered, _ = entry
+        if rendered is None:
+            rendered = renderer()
+            with self._lock:
+                if self._entries.get(artifact_id) is entry and entry[2] is None:
+                    self._bytes += len(rendered) - entry[3]
+                    entry[1], entry[2], entry[3] = None, rendered, len(rendered)
+        return rendered
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"items": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+def image_nbytes(image) -> int:
+    """Memory held by a decoded RGB image, for ArtifactStore size hints."""
+    return image.width * image.height * len(image.getbands())
+
+
+def build_multipart(payload: Dict, images: Dict[str, bytes]) -> tuple:
+    """
+    Encodes a JSON payload and JPEG images as a multipart/mixed body.
+    Returns (body, content_type).
+    """
+    boundary = uuid.uuid4().hex
+    chunks = [
+        f"--{boundary}\r\n"
+        "Content-Type: application/json\r\n"
+        "Content-Disposition: inline; name=\"result\"\r\n\r\n".encode("utf-8"),
+        json.dumps(payload).encode("utf-8"),
+        b"\r\n",
+    ]
+    for name, data in images.items():
+        chunks.extend([
+            f"--{boundary}\r\n"
+            "Content-Type: image/jpeg\r\n"
+            f"Content-Disposition: attachment; name=\"{name}\"; filename=\"{name}.jpg\"\r\n\r\n".encode("utf-8"),
+            data,
+            b"\r\n",
+        ])
+    chunks.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(chunks), f"multipart/mixed; boundary={boundary}"
@@ -0,0 +1,117 @@
+# file: logic/batching.py
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+
+class MicroBatcher:
+    """
+    Coalesces single-item requests from many callers into batched model calls.
+
+    Items submitted within `window_ms` of the first queued item (or until
+    `max_batch_size` items are collected) are passed to `batch_fn` together,
+    and each caller gets back its own result through a Future.
+    """
+    def __init__(self, name: str, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8, window_ms: float = 10.0):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000.0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_queue_depth = 0
+        self._batch_size_counts: Dict[int, int] = {}
+
+        self._thread = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queues one item and returns a Future resolving to its result."""
+        future = Future()
+        self._queue.put((item, future))
+        with self._lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def __call__(self, item: Any) -> Any:
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(item).result()
+
+    def map(self, items: List[Any]) -> List[Any]:
+        """Submits several items at once, so they share batches, and waits for all of their results."""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _collect(self) -> List:
+        """Blocks for the first item, then gathers more until the window closes."""
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return []
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Put the sentinel back so the loop exits after this batch.
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+
+            pending = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+
+            with self._lock:
+                self._batches += 1
+                self._items += len(pending)
+                self._batch_size_counts[len(pending)] = self._batch_size_counts.get(len(pending), 0) + 1
+
+            try:
+                results = self.batch_fn([item for item, _ in pending])
+                if len(results) != len(pending):
+                    raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(pending)} items.")
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        """Returns queue-depth and batch-size metrics for throughput tuning."""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_size_counts.items())),
+                "max_batch_size": self.max_batch_size,
+                "window_ms": self.window * 1000.0,
+            }
+
+    def close(self):
+        """Stops the worker thread after the queued items are processed."""
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,305 @@
+# file: logic/bulk.py
+
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from logic.ingest import ImageTooLargeError, UndecodableImageError, ingest_image
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+class BulkItem(NamedTuple):
+    """One image of a bulk run. `id` identifies it in the output and on resume."""
+    id: str
+    path: str
+    prompt: Optional[str] = None
+
+
+def iter_items(source: str, prompt: Optional[str] = None) -> Iterator[BulkItem]:
+    """
+    Lists the images of a bulk run, in a stable order:
+      - a directory: every image file under it, ids are the relative paths
+      - a .jsonl manifest: {"path": ..., "id": ..., "prompt": ...} per line
+      - any other file: one image path per line
+    Relative manifest paths are resolved against the manifest's folder.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield BulkItem(os.path.relpath(path, source), path, prompt)
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if source.endswith(".jsonl"):
+                entry = json.loads(line)
+                path = entry["path"]
+                yield BulkItem(str(entry.get("id", path)), os.path.join(base, path), entry.get("prompt", prompt))
+            else:
+                yield BulkItem(line, os.path.join(base, line), prompt)
+
+
+# --- Worker processes: read, decode and preprocess ahead of the model ---
+
+_image_processor = None
+
+
+def _init_worker(processor_path: Optional[str]):
+    global _image_processor
+    if processor_path:
+        from transformers import AutoProcessor
+
+        _image_processor = AutoProcessor.from_pretrained(processor_path).image_processor
+
+
+def _prepare(item: BulkItem, pipeline: bool):
+    """
+    Returns (item, payload, error). The payload is the IngestedImage in
+    pipeline mode, and otherwise the captioner's pixel values (or the decoded
+    image when the worker has no image processor).
+    """
+    try:
+        with open(item.path, "rb") as f:
+            image_bytes = f.read()
+    except OSError as e:
+        return item, None, f"The image could not be read: {e.strerror}."
+    try:
+        ingested = ingest_image(image_bytes)
+    except (ImageTooLargeError, UndecodableImageError) as e:
+        return item, None, str(e)
+
+    if pipeline:
+        return item, ingested, None
+    if _image_processor is None:
+        return item, ingested.image, None
+    return item, _image_processor(images=ingested.image, return_tensors="np")["pixel_values"][0], None
+
+
+def _prefetched(executor: ProcessPoolExecutor, fn: Callable, items: Iterable, depth: int) -> Iterator:
+    """Maps fn over items in the pool, in order, keeping at most `depth` items in flight."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= depth:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- Output writers: results are appended as they complete, and read back to resume ---
+
+class JsonlWriter:
+    """Appends one JSON record per line, flushed to disk after every batch."""
+    def __init__(self, path: str):
+        self.path = path
+
+    def completed_ids(self) -> Set[str]:
+        """Ids already written; a line torn by a crash is cut off so the file stays valid."""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        valid_end = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["id"])
+                except (ValueError, KeyError):
+                    break
+                valid_end += len(line)
+        if valid_end != os.path.getsize(self.path):
+            logger.warning("Truncating a partial record at the end of %s", self.path)
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_end)
+        return done
+
+    def write(self, records: List[Dict]):
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """
+    Writes a directory of Parquet part files. Records are buffered into parts
+    of `rows_per_part` rows; each part is written to a temporary name and
+    renamed, so a crash loses at most the buffered records. Nested fields
+    (matches, facts) are stored as JSON strings.
+    """
+    def __init__(self, path: str, rows_per_part: int = 1024):
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self._buffer: List[Dict] = []
+        os.makedirs(path, exist_ok=True)
+
+    def _parts(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".parquet"))
+
+    def completed_ids(self) -> Set[str]:
+        import pandas as pd
+
+        done = set()
+        for name in self._parts():
+            done.update(pd.read_parquet(os.path.join(self.path, name), columns=["id"])["id"])
+        return done
+
+    def write(self, records: List[Dict]):
+        self._buffer.extend(records)
+        if len(self._buffer) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        import pandas as pd
+
+        if not self._buffer:
+            return
+        rows = [{key: json.dumps(value) if isinstance(value, (list, dict)) else value for key, value in record.items()}
+                for record in self._buffer]
+        name = f"part-{len(self._parts()):05d}.parquet"
+        tmp_path = os.path.join(self.path, f".{name}.tmp")
+        pd.DataFrame(rows).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(self.path, name))
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+
+
+def open_writer(path: str, output_format: Optional[str] = None):
+    """A JSONL or Parquet writer, chosen by `output_format` or else by the path's extension."""
+    output_format = output_format or ("parquet" if path.endswith(".parquet") else "jsonl")
+    if output_format == "parquet":
+        return ParquetWriter(path)
+    return JsonlWriter(path)
+
+
+# --- The run ---
+
+def _caption_batch(captioner, prepared: List) -> List[Dict]:
+    """Captions the decoded items of a batch with one generate call."""
+    from logic.pipeline import INTERNAL_ERROR
+
+    records = [{"id": item.id, "path": item.path} for item, _, _ in prepared]
+    ok = [i for i, (_, payload, error) in enumerate(prepared) if error is None]
+    if ok:
+        payloads = [prepared[i][1] for i in ok]
+        try:
+            if hasattr(payloads[0], "shape"):
+                import numpy as np
+
+                captions = captioner.generate_from_pixels(np.stack(payloads))
+            else:
+                captions = captioner.generate_batch(payloads)
+        except Exception:
+            logger.exception("Bulk Caption Error")
+            captions = [None] * len(ok)
+        for i, caption in zip(ok, captions):
+            if caption is None:
+                records[i]["error"] = INTERNAL_ERROR
+            else:
+                records[i]["caption"] = caption
+    for record, (_, _, error) in zip(records, prepared):
+        if error is not None:
+            record["error"] = error
+    return records
+
+
+def _pipeline_batch(vocab, top_k: int, prepared: List) -> List[Dict]:
+    """Runs a batch through detect -> match -> crop -> caption, with the images decoded by the workers."""
+    from logic.pipeline import run_batch_chunk
+
+    items = [(ingested.image_bytes if ingested is not None else b"", item.prompt or "")
+             for item, ingested, _ in prepared]
+    results = run_batch_chunk(items, vocab, top_k=top_k,
+                              decoded=[(ingested, error) for _, ingested, error in prepared])
+    records = []
+    for (item, _, _), result in zip(prepared, results):
+        record = {"id": item.id, "path": item.path, "prompt": item.prompt}
+        record.update({key: value for key, value in result.items() if key != "index"})
+        records.append(record)
+    return records
+
+
+def run_bulk(items: Iterable[BulkItem], writer, captioner=None, vocab=None, top_k: int = 1,
+             batch_size: int = 16, workers: int = 4, prefetch: int = 64,
+             processor_path: Optional[str] = None, log_every_s: float = 10.0) -> Dict:
+    """
+    Captions every item the writer hasn't recorded yet. With `vocab` each item
+    goes through the full pipeline (models from models.loader), otherwise the
+    whole image is captioned by `captioner`. Workers are spawned, not forked,
+    so they never inherit the model threads of this process.
+    """
+    from logic.pipeline import INTERNAL_ERROR
+
+    done = writer.completed_ids()
+    if done:
+        print(f"⏩ Resuming: skipping {len(done)} completed item(s).")
+    todo = (item for item in items if item.id not in done)
+
+    pipeline = vocab is not None
+    process_batch = partial(_pipeline_batch, vocab, top_k) if pipeline else partial(_caption_batch, captioner)
+    processed, errors, retry = 0, 0, 0
+    start = last_log = time.perf_counter()
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker, initargs=(None if pipeline else processor_path,),
+    )
+    try:
+        prepared = _prefetched(executor, partial(_prepare, pipeline=pipeline), todo, max(prefetch, batch_size))
+        for batch in _batched(prepared, batch_size):
+            records = process_batch(batch)
+            # Internal errors may be transient (OOM, a model-server hiccup): they are not
+            # written, so the next run over the same output retries those items
+            kept = [record for record in records if record.get("error") != INTERNAL_ERROR]
+            writer.write(kept)
+            processed += len(kept)
+            errors += sum(1 for record in kept if "error" in record)
+            retry += len(records) - len(kept)
+
+            now = time.perf_counter()
+            if now - last_log >= log_every_s:
+                last_log = now
+                print(f"📦 {processed} item(s) captioned ({processed / (now - start):.1f}/s), "
+                      f"{errors} error(s), {retry} left to retry")
+    finally:
+        writer.close()
+        executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    summary = {"processed": processed, "errors": errors, "retry": retry, "skipped": len(done),
+               "elapsed_s": round(elapsed, 1)}
+    print(f"✅ Bulk run finished: {processed} item(s) in {elapsed:.1f}s, {errors} error(s), {len(done)} skipped.")
+    if retry:
+        print(f"⚠️ {retry} item(s) failed with an internal error and were not recorded; run again to retry them.")
+    return summary
@@ -0,0 +1,127 @@
+# file: logic/cache.py
+
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import config
+
+
+def hash_image_bytes(image_bytes: bytes) -> str:
+    """Content address of an uploaded image."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache with a memory budget in bytes.
+
+    Entries are sized by their pickled length. If `disk_dir` is set, entries are
+    also written through to disk and looked up there on a memory miss, so they
+    survive restarts and are shared by worker processes.
+    """
+    def __init__(self, name: str, max_bytes: int, disk_dir: Optional[str] = None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _disk_path(self, key: Hashable) -> str:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.pkl")
+
+    def _insert(self, key: Hashable, value: Any, size: int):
+        """Adds an entry and evicts least recently used ones. Caller holds the lock."""
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._evictions += 1
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the cached value, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    payload = f.read()
+                value = pickle.loads(payload)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            else:
+                with self._lock:
+                    self._disk_hits += 1
+                    self._insert(key, value, len(payload))
+                return value
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: Hashable, value: Any):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._insert(key, value, len(payload))
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️  Could not write {self.name} cache entry to disk: {e}")
+
+    def clear(self):
+        """Drops the in-memory entries (the disk tier, if any, is kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": ((self._hits + self._disk_hits) / lookups) if lookups else 0.0,
+            }
+
+
+# Detections keyed by image hash, and annotated JPEGs keyed by (image hash, "annotated")
+detection_cache = LRUCache("detections", config.DETECTION_CACHE_MAX_BYTES, config.CACHE_DIR or None)
+# Captions, keyed by (image hash, box)
+caption_cache = LRUCache("captions", config.CAPTION_CACHE_MAX_BYTES, config.CACHE_DIR or None)
+
+
+def cache_stats() -> Dict:
+    return {cache.name: cache.stats() for cache in (detection_cache, caption_cache)}
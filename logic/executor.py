@@ -0,0 +1,133 @@
+# file: logic/executor.py
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Optional
+
+
+class PipelineBusyError(Exception):
+    """Raised when the admission queue is full and a request is rejected."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs past its deadline."""
+
+
+def check_deadline(deadline: Optional[float], stage: str = ""):
+    """Aborts pipeline work nobody is waiting for anymore."""
+    if deadline is not None and time.time() > deadline:
+        raise DeadlineExceeded(f"Deadline exceeded before stage '{stage}'." if stage else "Deadline exceeded.")
+
+
+def remaining_time(deadline: Optional[float], default: float) -> float:
+    """Returns the seconds left before the deadline, capped at `default`."""
+    if deadline is None:
+        return default
+    return max(0.0, min(default, deadline - time.time()))
+
+
+class PipelineExecutor:
+    """
+    Runs blocking pipeline calls off the asyncio event loop.
+
+    Work is executed in a thread or process pool. At most `max_workers + max_queue`
+    requests are admitted at once; further requests fail fast with
+    PipelineBusyError. Each call gets an absolute `deadline` keyword argument
+    (a time.time() timestamp, so it is meaningful in worker processes too) that
+    the callee checks between stages.
+    """
+    def __init__(self, max_workers: int = 4, max_queue: int = 16, kind: str = "thread",
+                 initializer: Optional[Callable] = None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._pool: Executor
+        if kind == "process":
+            self._pool = ProcessPoolExecutor(max_workers=max_workers, initializer=initializer)
+        elif kind == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline",
+                                            initializer=initializer)
+        else:
+            raise ValueError(f"Unknown pool kind '{kind}'. Use 'thread' or 'process'.")
+
+    async def run(self, fn: Callable, *args, timeout: float, **kwargs) -> Any:
+        """Submits `fn(*args, deadline=..., **kwargs)` and awaits it with a deadline."""
+        if not self._slots.acquire(blocking=False):
+            raise PipelineBusyError("Pipeline queue is full.")
+
+        deadline = time.time() + timeout
+        try:
+            future = self._pool.submit(fn, *args, deadline=deadline, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            # Queued work is dropped; running work stops at its next deadline check.
+            future.cancel()
+            raise DeadlineExceeded(f"Request exceeded its {timeout:.1f}s deadline.")
+
+    def open_stream(self, fn: Callable, *args, timeout: float, **kwargs) -> AsyncIterator:
+        """
+        Like run(), for a generator function. Admission happens now (raising
+        PipelineBusyError when the queue is full); the returned async iterator
+        yields what `fn(*args, deadline=..., **kwargs)` produces in the pool and
+        raises DeadlineExceeded once the deadline passes. The slot is held until
+        the generator finishes, and closing the iterator early stops the
+        generator at its next item. Thread pools only.
+        """
+        if self.kind != "thread":
+            raise ValueError("Streaming requires a thread pool.")
+        if not self._slots.acquire(blocking=False):
+            raise PipelineBusyError("Pipeline queue is full.")
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        closed = threading.Event()
+        finished = object()
+        deadline = time.time() + timeout
+
+        def produce():
+            try:
+                for item in fn(*args, deadline=deadline, **kwargs):
+                    if closed.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (finished, e))
+                return
+            loop.call_soon_threadsafe(queue.put_nowait, (finished, None))
+
+        try:
+            future = self._pool.submit(produce)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        async def iterate():
+            try:
+                while True:
+                    try:
+                        item, error = await asyncio.wait_for(queue.get(), timeout=max(0.0, deadline - time.time()))
+                    except asyncio.TimeoutError:
+                        raise DeadlineExceeded(f"Stream exceeded its {timeout:.1f}s deadline.")
+                    if item is finished:
+                        if error is not None:
+                            raise error
+                        return
+                    yield item
+            finally:
+                closed.set()
+                future.cancel()
+
+        return iterate()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+# file: logic/ingest.py
+
+import io
+import math
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+import config
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds the byte or pixel limits."""
+
+
+class UndecodableImageError(ValueError):
+    """Raised when an upload is not an image PIL can decode."""
+
+
+class IngestedImage:
+    """
+    An upload decoded at a bounded working resolution.
+
+    `image` is the working-resolution RGB frame the detector and the annotated
+    output use; `scale` maps its coordinates to the original's. The original
+    is only decoded again, at the lowest resolution that still keeps the crop
+    detailed enough for the captioner, when a crop needs more pixels than the
+    working frame has.
+    """
+    def __init__(self, image_bytes: bytes, image: Image.Image, original_size: Tuple[int, int]):
+        self.image_bytes = image_bytes
+        self.image = image
+        self.original_size = original_size
+        self.scale = original_size[0] / image.width
+
+    def to_original(self, detections: List[Dict]) -> List[Dict]:
+        """Maps detections on the working frame to original-image coordinates."""
+        if self.scale == 1.0:
+            return detections
+        return [{**det, "box": [coord * self.scale for coord in det["box"]]} for det in detections]
+
+    def crop(self, box: List[float], min_side: int = None) -> Image.Image:
+        """Crops a box given in original-image coordinates, with at least `min_side` pixels on its short side where available."""
+        min_side = min_side or config.CROP_MIN_SIDE
+        x1, y1, x2, y2 = box
+        # How much the crop can be downscaled and still keep min_side pixels
+        reduction = max(1.0, min(x2 - x1, y2 - y1) / min_side)
+        if reduction >= self.scale:
+            return self.image.crop(tuple(coord / self.scale for coord in box))
+
+        with Image.open(io.BytesIO(self.image_bytes)) as original:
+            width, height = original.size
+            # JPEG: decode with DCT scaling at (or just above) the needed resolution
+            original.draft("RGB", (math.ceil(width / reduction), math.ceil(height / reduction)))
+            fx, fy = original.size[0] / width, original.size[1] / height
+            return original.convert("RGB").crop((x1 * fx, y1 * fy, x2 * fx, y2 * fy))
+
+
+def ingest_image(image_bytes: bytes, max_side: int = None, max_bytes: int = None, max_pixels: int = None) -> IngestedImage:
+    """
+    Checks an upload against the size limits and decodes it to a working
+    resolution whose long side is at most `max_side`. JPEGs are decoded in
+    draft mode, so the full-resolution frame is never materialized. Raises
+    ImageTooLargeError or UndecodableImageError for uploads it can't take.
+    """
+    max_side = max_side or config.INGEST_MAX_SIDE
+    max_bytes = max_bytes or config.INGEST_MAX_BYTES
+    max_pixels = max_pixels or config.INGEST_MAX_PIXELS
+
+    if len(image_bytes) > max_bytes:
+        raise ImageTooLargeError(f"The image is larger than {max_bytes // (1024 * 1024)} MB.")
+
+    try:
+        # Only the header is read here; pixels are decoded by convert()
+        image = Image.open(io.BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(f"The image has more than {max_pixels / 1e6:.0f} megapixels.") from e
+    except (OSError, SyntaxError, ValueError) as e:
+        raise UndecodableImageError("The image could not be decoded.") from e
+    original_size = image.size
+    if original_size[0] * original_size[1] > max_pixels:
+        raise ImageTooLargeError(f"The image has more than {max_pixels / 1e6:.0f} megapixels.")
+
+    ratio = max_side / max(original_size)
+    try:
+        if ratio < 1.0:
+            image.draft("RGB", (math.ceil(original_size[0] * ratio), math.ceil(original_size[1] * ratio)))
+            image = image.convert("RGB")
+            # Draft mode only scales by powers of two; finish with a resize
+            image.thumbnail((max_side, max_side), Image.BILINEAR)
+        else:
+            image = image.convert("RGB")
+    except (OSError, SyntaxError, ValueError) as e:
+        # Truncated or corrupt pixel data
+        raise UndecodableImageError("The image could not be decoded.") from e
+    return IngestedImage(image_bytes, image, original_size)
@@ -0,0 +1,136 @@
+# file: logic/metrics.py
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Latency buckets in seconds, from sub-millisecond encodes to multi-second captioning.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\"", "\\\"") for _, value in pairs)
+    return "{" + ",".join(f"{key}=\"{value}\"" for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # label key -> (bucket counts, sum, count)
+        self._values: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+STAGE_LATENCY = Histogram("captioner_stage_duration_seconds", "Latency of each pipeline stage.")
+STAGE_ERRORS = Counter("captioner_stage_errors_total", "Pipeline stages that raised an exception.")
+HTTP_LATENCY = Histogram("captioner_http_request_duration_seconds", "End-to-end HTTP request latency.")
+HTTP_REQUESTS = Counter("captioner_http_requests_total", "HTTP requests by path and status code.")
+
+# Per-request stage timings (ms), active only inside collect_timings()
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Times a pipeline stage into the latency histogram and the current request's breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000.0, 3)
+
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """Collects the spans run in this thread/context into a {stage: ms} dict."""
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Formats a stage breakdown as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={ms}" for stage, ms in timings.items())
+
+
+def _render_gauges(name: str, help_text: str, samples: Dict[LabelKey, float]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in sorted(samples.items()))
+    return lines
+
+
+def render_prometheus(batching: Dict[str, Dict], caches: Dict[str, Dict]) -> str:
+    """Renders all metrics, plus batcher and cache statistics, in Prometheus text format."""
+    lines: List[str] = []
+    for metric in (STAGE_LATENCY, STAGE_ERRORS, HTTP_LATENCY, HTTP_REQUESTS):
+        lines.extend(metric.render())
+
+    for field in ("queue_depth", "max_queue_depth", "batches", "items", "mean_batch_size"):
+        samples = {(("batcher", name),): stats[field] for name, stats in batching.items() if field in stats}
+        lines.extend(_render_gauges(f"captioner_batcher_{field}", f"Micro-batcher {field.replace('_', ' ')}.", samples))
+
+    for field in ("entries", "bytes", "hits", "disk_hits", "misses", "evictions"):
+        samples = {(("cache", name),): stats[field] for name, stats in caches.items() if field in stats}
+        lines.extend(_render_gauges(f"captioner_cache_{field}", f"Result cache {field.replace('_', ' ')}.", samples))
+
+    return "\n".join(lines) + "\n"
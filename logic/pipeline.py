@@ -3,13 +3,28 @@
 from PIL import Image, ImageDraw, ImageFont
 import io
 import base64
-from typing import Dict, List
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Tuple
 import requests
 
 from models.loader import models
+from phrase_index import PhraseIndex
+import config
+from logic.executor import DeadlineExceeded, check_deadline, remaining_time
+from logic.cache import caption_cache, detection_cache, hash_image_bytes
+from logic.ingest import ImageTooLargeError, IngestedImage, UndecodableImageError, ingest_image
+from logic.planner import FULL_PLAN, DetectionPlan
+from logic.artifacts import image_nbytes
+from logic.metrics import collect_timings, span
+import logging
 
-def _draw_detections(image: Image.Image, detections: List[Dict]) -> Image.Image:
-    """Helper function to draw all bounding boxes on an image."""
+logger = logging.getLogger(__name__)
+
+# Returned for unexpected failures; callers treat it as transient (bulk runs retry such items)
+INTERNAL_ERROR = "An internal error occurred during processing."
+
+def _draw_detections(image: Image.Image, detections: List[Dict], scale: float = 1.0) -> Image.Image:
+    """Helper function to draw all bounding boxes on an image (in place), dividing box coordinates by `scale`."""
     draw = ImageDraw.Draw(image)
     try:
         font = ImageFont.truetype("arial.ttf", 20)
@@ -17,7 +32,7 @@ def _draw_detections(image: Image.Image, detections: List[Dict]) -> Image.Image:
         font = ImageFont.load_default()
 
     for det in detections:
-        box = det['box']
+        box = [coord / scale for coord in det['box']]
         label = det['label']
         color = "blue" if label == 'car' else "green"
         draw.rectangle(box, outline=color, width=3)
@@ -26,65 +41,309 @@ def _draw_detections(image: Image.Image, detections: List[Dict]) -> Image.Image:
         
     return image
 
-def run_pipeline(image_bytes: bytes, text_prompt: str, vehicle_parts_vocab: set) -> Dict:
+def _encode_jpeg(image: Image.Image) -> bytes:
+    """Helper function to JPEG-encode an image."""
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+def render_annotated_jpeg(detection_key, image: Image.Image, scale: float, detections: List[Dict]) -> bytes:
     """
-    Runs the full pipeline and returns the caption and Base64-encoded images.
+    Draws all detections on a copy of the working-resolution frame and
+    JPEG-encodes the result, reusing a cached rendering. The frame itself is
+    never drawn on, so lazy artifacts can be rendered concurrently.
     """
-    try:
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    cache_key = (detection_key, "annotated")
+    annotated_jpeg = detection_cache.get(cache_key)
+    if annotated_jpeg is None:
+        with span("encode_annotated"):
+            annotated_jpeg = _encode_jpeg(_draw_detections(image.copy(), detections, scale))
+        detection_cache.put(cache_key, annotated_jpeg)
+    return annotated_jpeg
+
+def render_cropped_jpeg(cropped_image: Image.Image) -> bytes:
+    """JPEG-encodes the cropped object."""
+    with span("encode_cropped"):
+        return _encode_jpeg(cropped_image)
+
+def _plan_detection(keywords: List[str], vehicle_parts_vocab: PhraseIndex) -> DetectionPlan:
+    if models.planner is None:
+        return FULL_PLAN
+    return models.planner.plan(keywords, vehicle_parts_vocab)
 
-        # 1. Detect objects using the model from the manager
-        detected_objects = models.detector.detect_objects(image) 
-        if not detected_objects:
-            return {"error": "No objects were detected in the image."}
+def _cached_detections(image_hash: str, plan: DetectionPlan):
+    """Returns (cache key, detections or None); a cached full run serves every plan."""
+    detections = detection_cache.get(image_hash)
+    if detections is not None or plan.full:
+        return image_hash, detections
+    return plan.cache_key(image_hash), detection_cache.get(plan.cache_key(image_hash))
 
-        annotated_image = _draw_detections(image.copy(), detected_objects)
-        buffered_annotated = io.BytesIO()
-        annotated_image.save(buffered_annotated, format="JPEG")
-        annotated_image_base64 = base64.b64encode(buffered_annotated.getvalue()).decode("utf-8")
+def locate_object(image_bytes: bytes, text_prompt: str, vehicle_parts_vocab: PhraseIndex,
+                  deadline: Optional[float] = None) -> Dict:
+    """
+    Runs detection and matching, and crops the object the prompt refers to.
+    Returns the intermediate results, or a dict with an "error" key.
+    Raises ImageTooLargeError or UndecodableImageError for uploads ingest rejects.
+
+    Detection runs on a bounded working-resolution frame; the returned boxes
+    are in original-image coordinates and the crop comes from the original.
+    """
+    check_deadline(deadline, "decode")
+    image_hash = hash_image_bytes(image_bytes)
+    with span("decode"):
+        ingested = ingest_image(image_bytes)
 
-        # 2. Find the best match
+    # 1. Extract the keywords and plan which detector models they need
+    with span("extract_keywords"):
         keywords = models.matcher.extract_keywords(text_prompt, vehicle_parts_vocab) 
-        
-        #best_match_object = models.matcher.find_best_match(keywords, detected_objects)
-        
-        #print(f"Best match object: {best_match_object}")
-        
-        response = requests.post(
-            "https://374b27a6e238.ngrok-free.app/match/",
-            json={"keywords": keywords, "detected_objects": detected_objects},
-            timeout=10
-        )
-        if response.status_code != 200:
-            return {"error": f"Match API failed: {response.status_code}"}
-        
-        print(f"Match API Response: {response.json()}")
-        
-        best_match_object = response.json()
+        plan = _plan_detection(keywords, vehicle_parts_vocab)
+
+    # 2. Detect objects using the model from the manager (or reuse them for a repeated image)
+    detection_key, detected_objects = _cached_detections(image_hash, plan)
+    if detected_objects is None:
+        check_deadline(deadline, "detect")
+        with span("detect"):
+            detected_objects = ingested.to_original(models.detection_batcher((ingested.image, plan)))
+        detection_cache.put(detection_key, detected_objects)
+
+    if not detected_objects:
+        return {"error": "No objects were detected in the image."}
+
+    # 3. Find the best match
+    check_deadline(deadline, "match")
+    with span("match"):
+        if config.MATCH_BACKEND == "remote":
+            response = requests.post(
+                config.MATCH_API_URL,
+                json={"keywords": keywords, "detected_objects": detected_objects},
+                timeout=remaining_time(deadline, config.MATCH_API_TIMEOUT_S)
+            )
+            if response.status_code != 200:
+                return {"error": f"Match API failed: {response.status_code}"}
+
+            logger.debug("Match API Response: %s", response.json())
+            best_match_object = response.json()
+        else:
+            best_match_object = models.matcher.find_best_match(keywords, detected_objects)
+
+    if not best_match_object:
+        return {"error": "Could not find a confident match for the prompt."}
+
+    # 4. Crop the matched object
+    with span("crop"):
+        cropped_image = ingested.crop(best_match_object['box'])
+    return {
+        "best_match_object": best_match_object,
+        "cropped_image": cropped_image,
+        # Annotated image rendering is deferred until a client asks for it
+        "render_annotated": partial(render_annotated_jpeg, detection_key, ingested.image, ingested.scale, detected_objects),
+        "annotated_nbytes": image_nbytes(ingested.image),
+        "caption_key": (image_hash, tuple(round(coord, 1) for coord in best_match_object['box'])),
+    }
+
+def _corpus_query(label: str, caption: str) -> str:
+    if config.CORPUS_QUERY == "label":
+        return label
+    if config.CORPUS_QUERY == "caption":
+        return caption
+    return f"{label}: {caption}"
+
+def enrich_captions(pairs: List[Tuple[str, str]]) -> List[List[Dict]]:
+    """Retrieves car model/part facts for (label, caption) pairs in one vectorized lookup."""
+    if not config.CORPUS_ENRICHMENT or not pairs:
+        return [[] for _ in pairs]
+    with span("enrich"):
+        return models.lookup_facts([_corpus_query(label, caption) for label, caption in pairs])
+
+def run_pipeline(image_bytes: bytes, text_prompt: str, vehicle_parts_vocab: PhraseIndex,
+                 deadline: Optional[float] = None, artifacts: str = "none") -> Dict:
+    """
+    Runs the full pipeline and returns the caption and, depending on `artifacts`,
+    the annotated and cropped images:
+      - "none": no images are rendered or encoded.
+      - "inline": Base64-encoded JPEGs in the result.
+      - "multipart": raw JPEG bytes under "artifact_bytes".
+      - "lazy": (unrendered callable, bytes it holds) pairs under "artifact_renderers".
+
+    If a `deadline` (time.time() timestamp) is given, the pipeline stops between
+    stages once it has passed and raises DeadlineExceeded.
+
+    The per-stage latency breakdown (ms) is returned under "timings".
+    """
+    try:
+        with collect_timings() as timings:
+            located = locate_object(image_bytes, text_prompt, vehicle_parts_vocab, deadline)
+            if "error" in located:
+                return located
+            best_match_object = located["best_match_object"]
+            cropped_image = located["cropped_image"]
+
+            # 5. Generate the caption (cached per image and box)
+            final_caption = caption_cache.get(located["caption_key"])
+            if final_caption is None:
+                check_deadline(deadline, "caption")
+                with span("caption"):
+                    final_caption = models.caption_batcher(cropped_image)
+                caption_cache.put(located["caption_key"], final_caption)
+
+            result = {
+                "matched_object": best_match_object['label'],
+                "caption": final_caption,
+            }
+            facts = enrich_captions([(best_match_object['label'], final_caption)])[0]
+            if facts:
+                result["facts"] = facts
+
+            renderers = {
+                "annotated": located["render_annotated"],
+                "cropped": partial(render_cropped_jpeg, cropped_image),
+            }
+            if artifacts == "inline":
+                annotated_jpeg, cropped_jpeg = renderers["annotated"](), renderers["cropped"]()
+                with span("base64"):
+                    result["annotated_image_base64"] = base64.b64encode(annotated_jpeg).decode("utf-8")
+                    result["cropped_image_base64"] = base64.b64encode(cropped_jpeg).decode("utf-8")
+            elif artifacts == "multipart":
+                result["artifact_bytes"] = {name: render() for name, render in renderers.items()}
+            elif artifacts == "lazy":
+                result["artifact_renderers"] = {
+                    "annotated": (renderers["annotated"], located["annotated_nbytes"]),
+                    "cropped": (renderers["cropped"], image_nbytes(cropped_image)),
+                }
+
+        result["timings"] = timings
+        return result
+
+    except (DeadlineExceeded, ImageTooLargeError, UndecodableImageError):
+        raise
+    except Exception:
+        logger.exception("Pipeline Error")
+        return {"error": INTERNAL_ERROR}
+
+def stream_caption(located: Dict, deadline: Optional[float] = None) -> Iterator[Dict]:
+    """
+    Streams the caption of an object found by locate_object() as events:
+    one {"token": ...} per decoded piece, then a final {"matched_object", "caption"}
+    (with "facts" when the corpus has any). Stops with DeadlineExceeded
+    between pieces once the deadline has passed.
+    """
+    final_caption = caption_cache.get(located["caption_key"])
+    if final_caption is None:
+        pieces = []
+        for piece in models.captioner.generate_stream(located["cropped_image"]):
+            check_deadline(deadline, "caption")
+            pieces.append(piece)
+            yield {"token": piece}
+        final_caption = "".join(pieces)
+        caption_cache.put(located["caption_key"], final_caption)
+    else:
+        yield {"token": final_caption}
+
+    done = {"matched_object": located["best_match_object"]['label'], "caption": final_caption}
+    facts = enrich_captions([(done["matched_object"], final_caption)])[0]
+    if facts:
+        done["facts"] = facts
+    yield done
+
+def decode_for_batch(image_bytes: bytes) -> Tuple[Optional[IngestedImage], Optional[str]]:
+    """Ingests one image of a batch: the decoded image, or None and the error to report for it."""
+    try:
+        return ingest_image(image_bytes), None
+    except (ImageTooLargeError, UndecodableImageError) as e:
+        return None, str(e)
+
+
+def run_batch_chunk(items: List[Tuple[bytes, str]], vehicle_parts_vocab: PhraseIndex, top_k: int = 1,
+                    start_index: int = 0, deadline: Optional[float] = None,
+                    decoded: Optional[List[Tuple[Optional[IngestedImage], Optional[str]]]] = None) -> List[Dict]:
+    """
+    Captions the top-k matches of many (image, prompt) pairs: one detector batch
+    for the uncached images, one vectorized matching step, and one batched
+    caption call for every selected crop. Returns one result per item, with
+    "index" counted from `start_index`. Callers that decoded the images already
+    pass the decode_for_batch() result of every item as `decoded`.
+    """
+    results: List[Dict] = [{"index": start_index + i} for i in range(len(items))]
+    try:
+        check_deadline(deadline, "decode")
+        with span("extract_keywords"):
+            keywords = [models.matcher.extract_keywords(prompt, vehicle_parts_vocab) for _, prompt in items]
+            plans = [_plan_detection(kws, vehicle_parts_vocab) for kws in keywords]
+
+        hashes, images, detections, detection_keys, decode_errors = [], [], [], [], {}
+        for i, (image_bytes, _) in enumerate(items):
+            hashes.append(hash_image_bytes(image_bytes))
+            if decoded is not None:
+                image, error = decoded[i]
+            else:
+                with span("decode"):
+                    image, error = decode_for_batch(image_bytes)
+            images.append(image)
+            if error is not None:
+                decode_errors[i] = error
+            key, dets = _cached_detections(hashes[-1], plans[i])
+            detection_keys.append(key)
+            detections.append(dets if images[-1] is not None else [])
 
-        if not best_match_object:
-            return {"error": "Could not find a confident match for the prompt."}
+        # 1. Detect objects in every image that isn't cached, in one batch covering every prompt's plan.
+        #    Through the batcher, so the detector only ever runs on its thread.
+        check_deadline(deadline, "detect")
+        pending = [i for i, dets in enumerate(detections) if dets is None]
+        if pending:
+            with span("detect"):
+                batch_detections = models.detection_batcher.map([(images[i].image, plans[i]) for i in pending])
+            for i, dets in zip(pending, batch_detections):
+                detections[i] = dets = images[i].to_original(dets)
+                detection_cache.put(detection_keys[i], dets)
 
-        if not best_match_object:
-            return {"error": "Could not find a confident match for the prompt."}
+        # 2. Match every prompt against its image's detections at once
+        check_deadline(deadline, "match")
+        with span("match"):
+            ranked = models.matcher.rank_matches(keywords, detections, top_k=top_k)
 
-        # 3. Crop the matched object
-        cropped_image = image.crop(best_match_object['box'])
+        # 3. Crop every selected object and caption the uncached crops in one batch
+        check_deadline(deadline, "caption")
+        selections = []
+        for i, matches in enumerate(ranked):
+            for obj, score in matches:
+                caption_key = (hashes[i], tuple(round(coord, 1) for coord in obj['box']))
+                selections.append({"index": i, "object": obj, "score": score,
+                                   "key": caption_key, "caption": caption_cache.get(caption_key)})
 
-        # 4. Generate the caption
-        final_caption = models.captioner.generate(cropped_image) 
+        to_caption = [sel for sel in selections if sel["caption"] is None]
+        if to_caption:
+            crops = [images[sel["index"]].crop(sel["object"]['box']) for sel in to_caption]
+            with span("caption"):
+                captions = models.caption_batcher.map(crops)
+            for sel, caption in zip(to_caption, captions):
+                sel["caption"] = caption
+                caption_cache.put(sel["key"], caption)
 
-        buffered_cropped = io.BytesIO()
-        cropped_image.save(buffered_cropped, format="JPEG")
-        cropped_image_base64 = base64.b64encode(buffered_cropped.getvalue()).decode("utf-8")
+        all_facts = enrich_captions([(sel["object"]['label'], sel["caption"]) for sel in selections])
+        for sel, facts in zip(selections, all_facts):
+            match = {
+                "matched_object": sel["object"]['label'],
+                "caption": sel["caption"],
+                "box": sel["object"]['box'],
+                "score": sel["score"],
+            }
+            if facts:
+                match["facts"] = facts
+            results[sel["index"]].setdefault("matches", []).append(match)
 
-        return {
-            "matched_object": best_match_object['label'],
-            "caption": final_caption,
-            "annotated_image_base64": annotated_image_base64,
-            "cropped_image_base64": cropped_image_base64
-        }
+        for i, result in enumerate(results):
+            if "matches" in result:
+                continue
+            if images[i] is None:
+                result["error"] = decode_errors[i]
+            elif not detections[i]:
+                result["error"] = "No objects were detected in the image."
+            else:
+                result["error"] = "Could not find a confident match for the prompt."
+        return results
 
-    except Exception as e:
-        print(f"Pipeline Error: {e}")
-        return {"error": "An internal error occurred during processing."}
\ No newline at end of file
+    except DeadlineExceeded:
+        raise
+    except Exception:
+        logger.exception("Batch Pipeline Error")
+        return [{"index": result["index"], "error": INTERNAL_ERROR} for result in results]
@@ -0,0 +1,121 @@
+# file: logic/planner.py
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from phrase_index import PhraseIndex
+
+# Whole-vehicle categories of vehicle_parts_2.json. A prompt naming one of
+# these is answered by the general model's vehicle boxes.
+VEHICLE_CATEGORIES = frozenset({
+    "wahanaya", "motor rathaya", "jeepaya", "van ekak", "loriya", "bus ekak", "yathurapadiya",
+    "thriroda rathaya", "kab ekak", "koupaya", "sedanaya", "hachbek", "convertible ekak", "sport car",
+    "super car", "hyper car", "limousine ekak", "ambulance ekak", "gini niwana rathaya", "tractor ekak",
+    "trailer ekak",
+})
+
+LabelMap = Dict[str, Dict[int, str]]  # {"general": {class id: label}, "parts": {class id: label}}
+
+
+class DetectionPlan(NamedTuple):
+    """Which detector models a request needs, and the parts-model classes to keep."""
+    general: bool = True
+    parts: bool = True
+    parts_classes: Optional[Tuple[int, ...]] = None  # None: every parts-model class
+
+    @property
+    def full(self) -> bool:
+        return self.general and self.parts and self.parts_classes is None
+
+    def cache_key(self, image_hash: str):
+        """Detection cache key: the bare image hash for a full run, so full results are shared."""
+        return image_hash if self.full else (image_hash, "plan", self.general, self.parts, self.parts_classes)
+
+
+FULL_PLAN = DetectionPlan()
+
+
+class DetectionPlanner:
+    """
+    Maps the keywords of a prompt to the detector models (and parts-model
+    classes) whose labels can satisfy it. A keyword matches a label when both
+    resolve to the same vocabulary category. Prompts with no keywords, or with
+    a keyword no label or vehicle category covers, get the full plan.
+    """
+    def __init__(self, label_map: LabelMap, cascade: bool = False):
+        self.general_labels = {label.lower() for label in label_map["general"].values()}
+        self.parts_labels = {cls: label.lower() for cls, label in label_map["parts"].items()}
+        # The cascade finds parts inside the general model's vehicle boxes
+        self.cascade = cascade
+
+    def plan(self, keywords: List[str], vocabulary) -> DetectionPlan:
+        if not keywords or not isinstance(vocabulary, PhraseIndex):
+            return FULL_PLAN
+
+        general_categories = {vocabulary.category_of(label) or label for label in self.general_labels}
+        parts_categories: Dict[str, List[int]] = {}
+        for cls, label in self.parts_labels.items():
+            parts_categories.setdefault(vocabulary.category_of(label) or label, []).append(cls)
+
+        needs_general, parts_classes = False, set()
+        for keyword in keywords:
+            category = vocabulary.category_of(keyword) or keyword
+            matched = False
+            if category in parts_categories:
+                parts_classes.update(parts_categories[category])
+                matched = True
+            if category in general_categories or category in VEHICLE_CATEGORIES:
+                needs_general = True
+                matched = True
+            if not matched:
+                return FULL_PLAN
+
+        needs_parts = bool(parts_classes)
+        return DetectionPlan(
+            general=needs_general or (self.cascade and needs_parts),
+            parts=needs_parts,
+            parts_classes=tuple(sorted(parts_classes)) if needs_parts else None,
+        )
+
+
+def merge_plans(plans: Iterable[DetectionPlan]) -> DetectionPlan:
+    """The smallest plan covering every given plan, for running them as one batch."""
+    plans = list(plans)
+    parts_plans = [plan for plan in plans if plan.parts]
+    if any(plan.parts_classes is None for plan in parts_plans):
+        parts_classes = None
+    else:
+        parts_classes = tuple(sorted({cls for plan in parts_plans for cls in plan.parts_classes})) or None
+    return DetectionPlan(
+        general=any(plan.general for plan in plans),
+        parts=bool(parts_plans),
+        parts_classes=parts_classes,
+    )
+
+
+def filter_detections(detections: List[Dict], plan: DetectionPlan, label_map: LabelMap) -> List[Dict]:
+    """Keeps the detections with a label the plan asked for."""
+    if plan.full:
+        return detections
+    allowed = set()
+    if plan.general:
+        allowed.update(label.lower() for label in label_map["general"].values())
+    if plan.parts:
+        classes = label_map["parts"] if plan.parts_classes is None else plan.parts_classes
+        allowed.update(label_map["parts"][cls].lower() for cls in classes)
+    return [det for det in detections if det["label"] in allowed]
+
+
+def detect_planned_batch(detector, items: List[Tuple]) -> List[List[Dict]]:
+    """
+    Batch function for the detection micro-batcher: items are (image, plan)
+    pairs. The batch runs once with the merged plan, and each image gets back
+    only the labels its own plan asked for.
+    """
+    images = [image for image, _ in items]
+    plans = [plan or FULL_PLAN for _, plan in items]
+    merged = merge_plans(plans)
+    batch_detections = detector.detect_objects_batch(images, plan=None if merged.full else merged)
+    if merged.full and all(plan.full for plan in plans):
+        return batch_detections
+    label_map = detector.label_map()
+    return [filter_detections(dets, plan, label_map) for dets, plan in zip(batch_detections, plans)]
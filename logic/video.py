@@ -0,0 +1,285 @@
+# file: logic/video.py
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import config
+from logic.executor import check_deadline
+from logic.ingest import IngestedImage, ingest_image
+from logic.metrics import collect_timings, span
+from logic.planner import FULL_PLAN
+from models.loader import models
+from phrase_index import PhraseIndex
+
+# Side of the grayscale thumbnails frames and track regions are compared by
+SIGNATURE_SIZE = 16
+
+
+class SessionBusyError(Exception):
+    """Raised when a frame arrives while the session's previous frame is still being processed."""
+
+
+def _signature(image: Image.Image, box: Optional[List[float]] = None) -> np.ndarray:
+    """A tiny grayscale thumbnail of the image (or of a box in its coordinates), values in [0, 1]."""
+    if box is not None:
+        image = image.crop(tuple(box))
+    thumbnail = image.convert("L").resize((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.BILINEAR)
+    return np.asarray(thumbnail, dtype=np.float32) / 255.0
+
+
+def _change(a: Optional[np.ndarray], b: np.ndarray) -> float:
+    """Mean absolute difference of two signatures; 1.0 when there is nothing to compare with."""
+    return 1.0 if a is None else float(np.abs(a - b).mean())
+
+
+def _working_box(ingested: IngestedImage, box: List[float]) -> List[float]:
+    """Maps a box in original-image coordinates onto the working frame."""
+    return [coord / ingested.scale for coord in box]
+
+
+def _iou(a: List[float], b: List[float]) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """An object followed across frames, with the caption of its last captioned crop."""
+    def __init__(self, track_id: int, detection: Dict, signature: np.ndarray):
+        self.track_id = track_id
+        self.detection = detection
+        # Region signature when the track was last detected, for drift checks between keyframes
+        self.signature = signature
+        self.misses = 0
+        self.caption: Optional[str] = None
+        self.caption_signature: Optional[np.ndarray] = None
+        self.facts: List[Dict] = []
+
+    def describe(self) -> Dict:
+        return {"track_id": self.track_id, **self.detection}
+
+
+class VideoSession:
+    """
+    The state of one frame sequence. It is plain data, so it can be sent to a
+    pipeline worker process with each frame and sent back updated.
+    """
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.keywords: Optional[List[str]] = None
+        self.plan = FULL_PLAN
+        self.tracks: List[Track] = []
+        self.next_track_id = 1
+        self.frame_index = -1
+        self.last_keyframe = -1
+        self.keyframe_signature: Optional[np.ndarray] = None
+        self.stats = {"frames": 0, "keyframes": 0, "captions_generated": 0, "captions_reused": 0}
+
+    def _associate(self, detections: List[Dict], ingested: IngestedImage):
+        """Greedy same-label IoU matching of a keyframe's detections to the live tracks."""
+        pairs = sorted(
+            ((_iou(track.detection["box"], det["box"]), t, d)
+             for t, track in enumerate(self.tracks)
+             for d, det in enumerate(detections)
+             if track.detection["label"] == det["label"]),
+            key=lambda pair: pair[0], reverse=True,
+        )
+        matched_tracks, matched_detections = set(), set()
+        for iou, t, d in pairs:
+            if iou < config.VIDEO_TRACK_IOU:
+                break
+            if t in matched_tracks or d in matched_detections:
+                continue
+            matched_tracks.add(t)
+            matched_detections.add(d)
+            track = self.tracks[t]
+            track.detection, track.misses = detections[d], 0
+            track.signature = _signature(ingested.image, _working_box(ingested, track.detection["box"]))
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= config.VIDEO_TRACK_MAX_MISSES]
+        for d, det in enumerate(detections):
+            if d not in matched_detections:
+                signature = _signature(ingested.image, _working_box(ingested, det["box"]))
+                self.tracks.append(Track(self.next_track_id, det, signature))
+                self.next_track_id += 1
+
+    def _needs_keyframe(self, ingested: IngestedImage, frame_signature: np.ndarray) -> bool:
+        """Full detection runs periodically, and whenever the scene or a visible track's region drifted."""
+        if self.last_keyframe < 0 or self.frame_index - self.last_keyframe >= config.VIDEO_KEYFRAME_INTERVAL:
+            return True
+        if _change(self.keyframe_signature, frame_signature) > config.VIDEO_DRIFT_THRESHOLD:
+            return True
+        for track in self.tracks:
+            if track.misses:
+                continue
+            region = _signature(ingested.image, _working_box(ingested, track.detection["box"]))
+            if _change(track.signature, region) > config.VIDEO_DRIFT_THRESHOLD:
+                return True
+        return False
+
+
+def process_frame(session: VideoSession, image_bytes: bytes, vehicle_parts_vocab: PhraseIndex,
+                  deadline: Optional[float] = None) -> Tuple[VideoSession, Dict]:
+    """
+    Advances a session by one frame and returns (updated session, result).
+
+    Detection only runs on keyframes; in between, tracks keep their boxes. The
+    prompt's track is captioned again only when its crop changed by more than
+    VIDEO_CAPTION_CHANGE since it was last captioned, so a static scene costs
+    a decode and a few thumbnail comparisons per frame.
+
+    Failures raise: the session has been advanced part-way by then, so
+    callers discard it and keep the stored one.
+    """
+    with collect_timings() as timings:
+        check_deadline(deadline, "decode")
+        with span("decode"):
+            ingested = ingest_image(image_bytes)
+        session.frame_index += 1
+        session.stats["frames"] += 1
+        result = {"frame": session.frame_index}
+
+        if session.keywords is None:
+            with span("extract_keywords"):
+                session.keywords = models.matcher.extract_keywords(session.prompt, vehicle_parts_vocab)
+                if models.planner is not None:
+                    session.plan = models.planner.plan(session.keywords, vehicle_parts_vocab)
+
+        # 1. Detect on keyframes only, and carry the tracks over
+        frame_signature = _signature(ingested.image)
+        keyframe = session._needs_keyframe(ingested, frame_signature)
+        if keyframe:
+            check_deadline(deadline, "detect")
+            with span("detect"):
+                detections = ingested.to_original(models.detection_batcher((ingested.image, session.plan)))
+            session._associate(detections, ingested)
+            session.last_keyframe = session.frame_index
+            session.keyframe_signature = frame_signature
+            session.stats["keyframes"] += 1
+        result["keyframe"] = keyframe
+
+        visible = [track for track in session.tracks if track.misses == 0]
+        result["tracks"] = [track.describe() for track in visible]
+        if not visible:
+            result["error"] = "No objects were detected in the frame."
+            result["timings"] = timings
+            return session, result
+
+        # 2. Match the prompt against the visible tracks
+        check_deadline(deadline, "match")
+        with span("match"):
+            best = models.matcher.find_best_match(session.keywords, [track.detection for track in visible])
+        if not best:
+            result["error"] = "Could not find a confident match for the prompt."
+            result["timings"] = timings
+            return session, result
+        # Compared by value: a model server returns a copy of the detection
+        track = next(track for track in visible if track.detection == best)
+
+        # 3. Caption the track's crop unless it still looks like the captioned one
+        crop_signature = _signature(ingested.image, _working_box(ingested, track.detection["box"]))
+        reused = _change(track.caption_signature, crop_signature) <= config.VIDEO_CAPTION_CHANGE
+        if reused:
+            session.stats["captions_reused"] += 1
+        else:
+            check_deadline(deadline, "caption")
+            with span("crop"):
+                cropped_image = ingested.crop(track.detection["box"])
+            with span("caption"):
+                track.caption = models.caption_batcher(cropped_image)
+            track.caption_signature = crop_signature
+            session.stats["captions_generated"] += 1
+            # Lazy import: logic.pipeline imports requests and the artifact helpers
+            from logic.pipeline import enrich_captions
+
+            track.facts = enrich_captions([(track.detection["label"], track.caption)])[0]
+
+        result.update({
+            "track_id": track.track_id,
+            "matched_object": track.detection["label"],
+            "caption": track.caption,
+            "box": track.detection["box"],
+            "caption_reused": reused,
+        })
+        if track.facts:
+            result["facts"] = track.facts
+
+    result["timings"] = timings
+    return session, result
+
+
+class VideoSessionStore:
+    """
+    Holds the sessions of the serving process. Sessions expire `ttl_s` after
+    their last frame; a session is checked out while one of its frames is
+    being processed, so its frames run one at a time and in order.
+    """
+    def __init__(self, ttl_s: float = 120.0, max_items: int = 256):
+        self.ttl_s = ttl_s
+        self.max_items = max_items
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # id -> [expires_at, session, busy]
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        """Drops expired and overflowing idle entries. Caller holds the lock."""
+        now = time.monotonic()
+        for session_id, (expires_at, _, busy) in list(self._entries.items()):
+            if busy:
+                continue
+            if expires_at <= now or len(self._entries) > self.max_items:
+                del self._entries[session_id]
+
+    def create(self, prompt: str) -> str:
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[session_id] = [time.monotonic() + self.ttl_s, VideoSession(prompt), False]
+            self._expire()
+        return session_id
+
+    def checkout(self, session_id: str) -> Optional[VideoSession]:
+        """
+        Returns the session for processing a frame, or None if unknown/expired.
+        Callers process a copy of it and check the result in, so a failed or
+        timed-out frame leaves the stored session as it was.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if entry[2]:
+                raise SessionBusyError("A frame of this session is still being processed.")
+            entry[2] = True
+            return entry[1]
+
+    def checkin(self, session_id: str, session: VideoSession):
+        """Stores the updated session (a worker process returns a copy) and restarts its TTL."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+                entry[:] = [time.monotonic() + self.ttl_s, session, False]
+
+    def release(self, session_id: str):
+        """Marks a session idle again after a failed frame, keeping its previous state."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry[2] = False
+
+    def close(self, session_id: str) -> Optional[Dict]:
+        """Removes a session and returns its frame/caption counters."""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        return None if entry is None else dict(entry[1].stats)
@@ -1,14 +1,33 @@
 
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from typing import Dict
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware  # <-- 1. Import the middleware
 
 # Import your project modules
 from models.loader import models
-from logic.pipeline import run_pipeline
-from utils import load_vehicle_parts
+from logic.pipeline import INTERNAL_ERROR, locate_object, run_batch_chunk, run_pipeline, stream_caption
+from logic.executor import PipelineExecutor, PipelineBusyError, DeadlineExceeded
+from logic.cache import cache_stats
+from logic.ingest import ImageTooLargeError, UndecodableImageError
+from logic.artifacts import ARTIFACT_MODES, ArtifactStore, build_multipart
+from logic.video import SessionBusyError, VideoSessionStore, process_frame
+from logic.metrics import HTTP_LATENCY, HTTP_REQUESTS, render_prometheus, server_timing_header
+from utils import load_phrase_index
+import config
+
+logging.basicConfig(level=config.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Object-Specific Image Captioner API",
@@ -26,35 +45,333 @@ app.add_middleware(
 )
 # --------------------------------
 
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template (not the raw path) so /artifacts/{id} stays one series
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    HTTP_LATENCY.observe(time.perf_counter() - start, path=path)
+    HTTP_REQUESTS.inc(path=path, status=str(response.status_code))
+    return response
+
 class CaptionResponse(BaseModel):
     matched_object: str
     caption: str
-    annotated_image_base64: str
-    cropped_image_base64: str
+    # Only present with ?artifacts=inline
+    annotated_image_base64: Optional[str] = None
+    cropped_image_base64: Optional[str] = None
+    # Only present with ?artifacts=lazy: artifact name -> fetch URL
+    artifacts: Optional[Dict[str, str]] = None
+    # Car model/part facts retrieved from car_corpus_dataset.json, best first
+    facts: Optional[List[Dict]] = None
+
+executor: PipelineExecutor = None
+artifact_store = ArtifactStore(ttl_s=config.ARTIFACT_TTL_S, max_items=config.ARTIFACT_MAX_ITEMS,
+                               max_bytes=config.ARTIFACT_MAX_BYTES)
+# Video session state lives here and travels to the pool with each frame
+video_sessions = VideoSessionStore(ttl_s=config.VIDEO_SESSION_TTL_S, max_items=config.VIDEO_MAX_SESSIONS)
+
+# Set once every worker process has finished loading its models (process pool only)
+pool_ready = False
+
+def _probe_worker(hold_s: float = 0.0, deadline: Optional[float] = None) -> dict:
+    """Reports this worker's models. Holding the worker briefly spreads concurrent probes over the pool."""
+    time.sleep(hold_s)
+    return {**models.startup_report(), "pid": os.getpid()}
+
+async def _wait_for_worker_pool():
+    """
+    Probes the pool, one probe per worker, until every worker process has
+    answered ready. A worker only takes a probe once its initializer
+    (models.load_all) has finished.
+    """
+    global pool_ready
+    ready_pids = set()
+    give_up = time.monotonic() + config.STARTUP_TIMEOUT_S
+    while len(ready_pids) < executor.max_workers and time.monotonic() < give_up:
+        timeout = max(1.0, give_up - time.monotonic())
+        reports = await asyncio.gather(
+            *(executor.run(_probe_worker, 0.2, timeout=timeout) for _ in range(executor.max_workers)),
+            return_exceptions=True
+        )
+        ready_pids.update(report["pid"] for report in reports if isinstance(report, dict) and report["ready"])
+    pool_ready = len(ready_pids) >= executor.max_workers
+    if not pool_ready:
+        logger.error("Only %d of %d pipeline workers loaded their models in time.", len(ready_pids), executor.max_workers)
+
+def is_ready() -> bool:
+    if config.PIPELINE_POOL_KIND == "process":
+        return pool_ready
+    return models.ready
 
 @app.on_event("startup")
 async def startup_event():
-    models.load_all()
+    global executor
+    if config.PIPELINE_POOL_KIND == "process":
+        # Every worker process owns its own copy of the models.
+        executor = PipelineExecutor(config.PIPELINE_WORKERS, config.PIPELINE_QUEUE_SIZE,
+                                    kind="process", initializer=models.load_all)
+        asyncio.create_task(_wait_for_worker_pool())
+    else:
+        # Load in the background so /healthz answers while the models load and warm up
+        models.load_all_in_background()
+        executor = PipelineExecutor(config.PIPELINE_WORKERS, config.PIPELINE_QUEUE_SIZE, kind="thread")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if executor is not None:
+        executor.shutdown()
+
+VEHICLE_VOCAB = load_phrase_index("vehicle_parts_2.json")
 
-VEHICLE_VOCAB = load_vehicle_parts("vehicle_parts_2.json")
+async def run_in_pool(fn, *args, **kwargs):
+    """
+    Runs a pipeline function in the worker pool so the event loop keeps serving
+    other requests. The pool passes `deadline=` by keyword, so options after
+    the positional arguments must be passed by keyword too.
+    """
+    if not is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail="Models are still loading, please retry shortly.",
+            headers={"Retry-After": str(config.RETRY_AFTER_S)}
+        )
+    try:
+        return await executor.run(fn, *args, timeout=config.REQUEST_TIMEOUT_S, **kwargs)
+    except PipelineBusyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly.",
+            headers={"Retry-After": str(config.RETRY_AFTER_S)}
+        )
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="The request took too long to process.")
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UndecodableImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/", tags=["General"])
 async def read_root():
     return {"message": "Welcome to the BLIP Object Captioning API!"}
 
 
-@app.post("/caption/", response_model=CaptionResponse, tags=["Captioning"])
+@app.get("/healthz", tags=["General"])
+async def liveness():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz", tags=["General"])
+async def readiness():
+    """Readiness: every model is loaded and warmed up, with per-model timings."""
+    if config.PIPELINE_POOL_KIND == "process":
+        report = {"ready": pool_ready, "pool": "process"}
+    else:
+        report = models.startup_report()
+    if not report["ready"]:
+        return JSONResponse(status_code=503, content=report)
+    return report
+
+
+@app.get("/stats/batching", tags=["General"])
+async def batching_stats():
+    return models.batching_stats()
+
+
+@app.get("/stats/cache", tags=["General"])
+async def cache_statistics():
+    return {**cache_stats(), "artifacts": artifact_store.stats()}
+
+
+@app.get("/metrics", tags=["General"])
+async def metrics():
+    """Stage and HTTP latency histograms plus batcher/cache gauges, in Prometheus text format."""
+    return PlainTextResponse(
+        render_prometheus(models.batching_stats(), cache_stats()),
+        media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.post("/caption/", response_model=CaptionResponse, response_model_exclude_none=True, tags=["Captioning"])
 async def create_caption(
+    response: Response,
     image: UploadFile = File(..., description="The image file to process."),
-    prompt: str = Form(..., description="A text prompt describing the object of interest.")
-) -> Dict:
-    image_bytes = await image.read()
-    result = run_pipeline(
-        image_bytes=image_bytes,
-        text_prompt=prompt,
-        vehicle_parts_vocab=VEHICLE_VOCAB
-    )
+    prompt: str = Form(..., description="A text prompt describing the object of interest."),
+    artifacts: str = Query("none", description="How to return the annotated and cropped images: "
+                                               "none, inline (Base64 JSON), multipart, or lazy (fetch from /artifacts/{id}).")
+):
+    if artifacts not in ARTIFACT_MODES:
+        raise HTTPException(status_code=422, detail=f"artifacts must be one of: {', '.join(ARTIFACT_MODES)}.")
+
+    # Read at most one byte past the limit; the ingest step rejects anything longer
+    image_bytes = await image.read(config.INGEST_MAX_BYTES + 1)
+    result = await run_in_pool(run_pipeline, image_bytes, prompt, VEHICLE_VOCAB, artifacts=artifacts)
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
+
+    timings = result.pop("timings", {})
+    headers = {"Server-Timing": server_timing_header(timings)} if config.TIMING_HEADER and timings else None
+
+    if artifacts == "multipart":
+        images = result.pop("artifact_bytes")
+        body, content_type = build_multipart(result, images)
+        return Response(content=body, media_type=content_type, headers=headers)
+    if artifacts == "lazy":
+        renderers = result.pop("artifact_renderers")
+        result["artifacts"] = {
+            name: f"/artifacts/{artifact_store.put(render, nbytes)}" for name, (render, nbytes) in renderers.items()
+        }
     
-    return result
\ No newline at end of file
+    if headers:
+        response.headers.update(headers)
+    return result
+
+
+@app.post("/caption/batch", tags=["Captioning"])
+async def create_caption_batch(
+    images: List[UploadFile] = File(..., description="The image files to process."),
+    prompts: List[str] = Form(..., description="One prompt per image, or a single prompt for all images."),
+    top_k: int = Form(1, ge=1, le=20, description="How many matched objects to caption per image.")
+):
+    """Captions many images, streaming one NDJSON line per image as its chunk finishes."""
+    if not is_ready():
+        raise HTTPException(
+            status_code=503,
+            detail="Models are still loading, please retry shortly.",
+            headers={"Retry-After": str(config.RETRY_AFTER_S)}
+        )
+    if len(images) > config.BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"At most {config.BATCH_MAX_IMAGES} images per batch.")
+    if len(prompts) not in (1, len(images)):
+        raise HTTPException(status_code=422, detail="Send one prompt per image, or a single prompt for all images.")
+
+    async def results():
+        for start in range(0, len(images), config.BATCH_CHUNK_SIZE):
+            # Uploads are read one chunk at a time, so at most a chunk of images is held in memory
+            chunk = [
+                (await upload.read(config.INGEST_MAX_BYTES + 1), prompts[i] if len(prompts) > 1 else prompts[0])
+                for i, upload in enumerate(images[start:start + config.BATCH_CHUNK_SIZE], start)
+            ]
+            retry_until = time.monotonic() + config.REQUEST_TIMEOUT_S
+            while True:
+                try:
+                    chunk_results = await executor.run(
+                        run_batch_chunk, chunk, VEHICLE_VOCAB, top_k, start,
+                        timeout=config.REQUEST_TIMEOUT_S
+                    )
+                except PipelineBusyError:
+                    # Batch jobs wait for capacity instead of failing the rest of the stream
+                    if time.monotonic() < retry_until:
+                        await asyncio.sleep(config.RETRY_AFTER_S)
+                        continue
+                    chunk_results = [{"index": start + i, "error": "Server is busy."} for i in range(len(chunk))]
+                except DeadlineExceeded:
+                    chunk_results = [{"index": start + i, "error": "The request took too long to process."} for i in range(len(chunk))]
+                break
+            for result in chunk_results:
+                yield json.dumps(result) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.get("/artifacts/{artifact_id}", tags=["Captioning"])
+async def get_artifact(artifact_id: str):
+    """Renders (on first access) and returns an image produced with ?artifacts=lazy."""
+    data = await run_in_threadpool(artifact_store.get, artifact_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Artifact not found or expired.")
+    return Response(content=data, media_type="image/jpeg")
+
+
+@app.post("/caption/stream", tags=["Captioning"])
+async def stream_caption_tokens(
+    image: UploadFile = File(..., description="The image file to process."),
+    prompt: str = Form(..., description="A text prompt describing the object of interest.")
+):
+    """Streams the caption as Server-Sent Events: "token" events, then one "done" event."""
+    if config.PIPELINE_POOL_KIND == "process":
+        raise HTTPException(status_code=501, detail="Streaming requires PIPELINE_POOL_KIND=thread.")
+
+    image_bytes = await image.read(config.INGEST_MAX_BYTES + 1)
+    located = await run_in_pool(locate_object, image_bytes, prompt, VEHICLE_VOCAB)
+    if "error" in located:
+        raise HTTPException(status_code=404, detail=located["error"])
+
+    # Token generation holds a pipeline slot and the request deadline like any other call
+    try:
+        stream = executor.open_stream(stream_caption, located, timeout=config.REQUEST_TIMEOUT_S)
+    except PipelineBusyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly.",
+            headers={"Retry-After": str(config.RETRY_AFTER_S)}
+        )
+
+    async def events():
+        try:
+            async for event in stream:
+                name = "done" if "caption" in event else "token"
+                yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+        except DeadlineExceeded:
+            yield f"event: error\ndata: {json.dumps({'detail': 'The request took too long to process.'})}\n\n"
+        except Exception:
+            logger.exception("Caption Stream Error")
+            yield f"event: error\ndata: {json.dumps({'detail': 'An internal error occurred during processing.'})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/video/sessions", tags=["Video"])
+async def create_video_session(
+    prompt: str = Form(..., description="A text prompt describing the object of interest.")
+):
+    """Starts a frame-sequence session; post its frames, in order, to /video/sessions/{id}/frames."""
+    return {"session_id": video_sessions.create(prompt), "ttl_s": config.VIDEO_SESSION_TTL_S}
+
+
+@app.post("/video/sessions/{session_id}/frames", tags=["Video"])
+async def post_video_frame(
+    session_id: str,
+    response: Response,
+    image: UploadFile = File(..., description="The next frame of the sequence.")
+):
+    """
+    Processes the next frame of a session. Detection only runs on keyframes,
+    and the matched track's caption is reused while its crop stays the same.
+    """
+    try:
+        session = video_sessions.checkout(session_id)
+    except SessionBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if session is None:
+        raise HTTPException(status_code=404, detail="Video session not found or expired.")
+
+    try:
+        image_bytes = await image.read(config.INGEST_MAX_BYTES + 1)
+        # A private copy: a worker still running after a 504 must not touch the stored session
+        session, result = await run_in_pool(process_frame, copy.deepcopy(session), image_bytes, VEHICLE_VOCAB)
+    except BaseException as e:
+        # The half-advanced copy is dropped; the stored session stays at the previous frame
+        video_sessions.release(session_id)
+        if isinstance(e, Exception) and not isinstance(e, HTTPException):
+            logger.exception("Video Frame Error")
+            raise HTTPException(status_code=500, detail=INTERNAL_ERROR) from e
+        raise
+    video_sessions.checkin(session_id, session)
+
+    timings = result.pop("timings", {})
+    if config.TIMING_HEADER and timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return result
+
+
+@app.delete("/video/sessions/{session_id}", tags=["Video"])
+async def close_video_session(session_id: str):
+    """Ends a session and returns how many frames needed detection and captioning."""
+    stats = video_sessions.close(session_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Video session not found or expired.")
+    return {"session_id": session_id, **stats}
@@ -1,9 +1,15 @@
 # file: models/loader.py (Updated to initialize the two-model detector)
 
-from object_detector import ObjectDetector
-from caption_generator import CaptionGenerator
-from semantic_matcher import SemanticMatcher
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from PIL import Image
+from logic.batching import MicroBatcher
+from logic.planner import DetectionPlanner, detect_planned_batch
+import config
 import os
+import threading
+import time
+from typing import Dict, List
 
 class ModelManager:
     """A class to load and hold all ML models."""
@@ -11,26 +17,219 @@ class ModelManager:
         self.detector = None
         self.captioner = None
         self.matcher = None
+        self.detection_batcher = None
+        self.caption_batcher = None
+        # Maps prompt keywords to the detector models/classes to run (None: always run both)
+        self.planner = None
+        # Memory-mapped car facts for caption enrichment (None: disabled or not built)
+        self.corpus = None
+
+        # Per-model state ("pending", "loading", "warming", "ready", "failed") and timings
+        self.status = {name: {"state": "pending"} for name in ("detector", "captioner", "matcher")}
+        self.ready = False
+        self.error = None
+        self._status_lock = threading.Lock()
+
+    def _set_status(self, name: str, **fields):
+        with self._status_lock:
+            self.status[name].update(fields)
+
+    # The model modules are imported when loaded, so processes that only talk to
+    # a model server (see models/remote.py) never import torch/ultralytics.
+    def _load_detector(self):
+        from object_detector import ObjectDetector
 
-    def load_all(self):
-        """Loads all models into the instance attributes."""
-        global detector, captioner, matcher
-        print("--- Loading all models into memory... ---")
-        
         # Place your 'best.pt' file in the main project folder.
-        fine_tuned_yolo_path = "best.pt" 
+        fine_tuned_yolo_path = "best.pt"
         if not os.path.exists(fine_tuned_yolo_path):
             raise FileNotFoundError(f"Could not find the fine-tuned model at '{fine_tuned_yolo_path}'. Please place 'best.pt' in the main project directory.")
 
         # Initialize the ObjectDetector with paths to both models
-        self.detector = ObjectDetector(
+        return ObjectDetector(
             general_model_name='yolov8n.pt',
-            parts_model_path=fine_tuned_yolo_path
+            parts_model_path=fine_tuned_yolo_path,
+            cascade=config.DETECTOR_CASCADE,
+            cascade_imgsz=config.CASCADE_PARTS_IMGSZ,
+            roi_padding=config.CASCADE_ROI_PADDING,
+            imgsz=config.DETECTOR_IMGSZ,
+            nms_iou=config.DETECTOR_NMS_IOU
         )
-        
-        self.captioner = CaptionGenerator(peft_model_path="./blip-finetuned-model")
-        self.matcher = SemanticMatcher()
-        print("--- ✅ All models loaded successfully. API is ready. ---")
 
-# Create a single, global instance of the model manager
-models = ModelManager()
\ No newline at end of file
+    def _load_captioner(self):
+        from caption_generator import CaptionGenerator
+
+        return CaptionGenerator(
+            peft_model_path="./blip-finetuned-model",
+            backend=config.CAPTION_BACKEND,
+            artifact_dir=config.CAPTION_ARTIFACT_DIR,
+            num_threads=config.CAPTION_CPU_THREADS,
+            max_new_tokens=config.CAPTION_MAX_NEW_TOKENS,
+            early_stop=config.CAPTION_EARLY_STOP
+        )
+
+    def _load_matcher(self):
+        from semantic_matcher import SemanticMatcher
+
+        return SemanticMatcher(keyword_cache_size=config.KEYWORD_CACHE_SIZE)
+
+    # MODELS_STUB=1: weight-free stand-ins (see models/stub.py) for benchmarks and load tests.
+    # The matcher is the real one over a hashing encoder, so matching costs stay representative.
+    def _load_stub_detector(self):
+        from models.stub import StubDetector
+
+        return StubDetector(latency_ms=config.STUB_DETECT_MS)
+
+    def _load_stub_captioner(self):
+        from models.stub import StubCaptioner
+
+        return StubCaptioner(latency_ms=config.STUB_CAPTION_MS)
+
+    def _load_stub_matcher(self):
+        from models.stub import HashingEncoder
+        from semantic_matcher import SemanticMatcher
+
+        return SemanticMatcher(keyword_cache_size=config.KEYWORD_CACHE_SIZE, model=HashingEncoder())
+
+    def _load_corpus(self):
+        """Memory-maps the corpus index built by corpus_index.py, if it is there and matches the matcher."""
+        from corpus_index import CorpusIndex
+        from embedding_store import EmbeddingStore
+
+        if not config.CORPUS_ENRICHMENT:
+            return None
+        if not EmbeddingStore.exists(config.CORPUS_INDEX_PATH):
+            print(f"⚠️  No corpus index at {config.CORPUS_INDEX_PATH}; run `python corpus_index.py` to enable caption facts.")
+            return None
+        corpus = CorpusIndex.load(config.CORPUS_INDEX_PATH)
+        if corpus.dimension != self.matcher.model.get_sentence_embedding_dimension():
+            print(f"⚠️  Corpus index was built with {corpus.store.model_name} ({corpus.dimension}-d), "
+                  "which doesn't match the matcher; caption facts are disabled.")
+            return None
+        print(f"✅ Memory-mapped corpus index ({len(corpus.store)} entries).")
+        return corpus
+
+    def _load_vocabulary_store(self):
+        """Loads the vocabulary embeddings built by vocabulary_index.py into the matcher, if present."""
+        from embedding_store import EmbeddingStore
+
+        if not config.VOCAB_STORE_PATH or not EmbeddingStore.exists(config.VOCAB_STORE_PATH):
+            print(f"⚠️  No vocabulary embeddings at {config.VOCAB_STORE_PATH}; "
+                  "run `python vocabulary_index.py` to match out-of-vocabulary prompt words.")
+            return
+        store = EmbeddingStore.load(config.VOCAB_STORE_PATH)
+        if store.dimension != self.matcher.model.get_sentence_embedding_dimension():
+            print(f"⚠️  Vocabulary embeddings were built with {store.model_name} ({store.dimension}-d), "
+                  "which doesn't match the matcher; out-of-vocabulary snapping is disabled.")
+            return
+        # Searched on every unmatched prompt, so keep an upcast copy instead of the mapped float16 matrix
+        self.matcher.set_vocabulary_store(store.in_memory(), config.VOCAB_SNAP_THRESHOLD, config.VOCAB_SNAP_MAX_NGRAM)
+        print(f"✅ Loaded vocabulary embeddings ({len(store)} phrases).")
+
+    def _warm_up(self, name: str, model):
+        """Runs dummy inferences so CUDA kernels, allocators and tokenizers are initialized before real traffic."""
+        for _ in range(config.WARMUP_RUNS):
+            if name == "detector":
+                model.detect_objects_batch([Image.new("RGB", (640, 480))])
+            elif name == "captioner":
+                model.generate(Image.new("RGB", (384, 384)))
+            elif name == "matcher":
+                model.find_best_match(["car"], [{"box": [0, 0, 1, 1], "label": "car", "confidence": 1.0}])
+
+    def _load_one(self, name: str, loader):
+        """Loads and warms up one model, recording its timings."""
+        self._set_status(name, state="loading")
+        start = time.perf_counter()
+        try:
+            model = loader()
+            loaded = time.perf_counter()
+            self._set_status(name, state="warming", load_s=round(loaded - start, 3))
+            if name != "matcher":
+                # The matcher warms up after its label index is built
+                self._warm_up(name, model)
+                self._set_status(name, state="ready", warmup_s=round(time.perf_counter() - loaded, 3))
+            return model
+        except Exception as e:
+            self._set_status(name, state="failed", error=str(e))
+            raise
+
+    def load_all(self):
+        """Loads all models concurrently into the instance attributes, then warms them up."""
+        print(f"--- Loading all {'stub ' if config.MODELS_STUB else ''}models into memory... ---")
+        start = time.perf_counter()
+        if config.MODELS_STUB:
+            loaders = {"detector": self._load_stub_detector, "captioner": self._load_stub_captioner,
+                       "matcher": self._load_stub_matcher}
+        else:
+            loaders = {"detector": self._load_detector, "captioner": self._load_captioner, "matcher": self._load_matcher}
+        with ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="model-loader") as pool:
+            futures = {name: pool.submit(self._load_one, name, loader) for name, loader in loaders.items()}
+            loaded = {name: future.result() for name, future in futures.items()}
+        self.detector, self.captioner, self.matcher = loaded["detector"], loaded["captioner"], loaded["matcher"]
+
+        warmup_start = time.perf_counter()
+        self.matcher.build_label_index(self.detector.label_names())
+        self._load_vocabulary_store()
+        self._warm_up("matcher", self.matcher)
+        self._set_status("matcher", state="ready", warmup_s=round(time.perf_counter() - warmup_start, 3))
+        self.corpus = self._load_corpus()
+
+        if config.DETECTION_PLANNING:
+            self.planner = DetectionPlanner(self.detector.label_map(), cascade=config.DETECTOR_CASCADE)
+
+        # Coalesce concurrent requests into batched model calls; items are (image, plan) pairs
+        self.detection_batcher = MicroBatcher(
+            "detection", partial(detect_planned_batch, self.detector),
+            max_batch_size=config.DETECT_BATCH_MAX_SIZE, window_ms=config.DETECT_BATCH_WINDOW_MS
+        )
+        self.caption_batcher = MicroBatcher(
+            "caption", self.captioner.generate_batch,
+            max_batch_size=config.CAPTION_BATCH_MAX_SIZE, window_ms=config.CAPTION_BATCH_WINDOW_MS
+        )
+        self.ready = True
+        print(f"--- ✅ All models loaded in {time.perf_counter() - start:.1f}s. API is ready. ---")
+        for name, status in self.status.items():
+            print(f"   - {name}: load {status.get('load_s', 0):.1f}s, warm-up {status.get('warmup_s', 0):.1f}s")
+
+    def load_all_in_background(self) -> threading.Thread:
+        """Starts load_all() in a thread so the server can answer liveness probes meanwhile."""
+        def run():
+            try:
+                self.load_all()
+            except Exception as e:
+                self.error = str(e)
+                print(f"❌ Model loading failed: {e}")
+
+        thread = threading.Thread(target=run, name="model-startup", daemon=True)
+        thread.start()
+        return thread
+
+    def startup_report(self) -> dict:
+        """Returns readiness and per-model load/warm-up timings."""
+        with self._status_lock:
+            return {
+                "ready": self.ready,
+                "error": self.error,
+                "models": {name: dict(status) for name, status in self.status.items()},
+            }
+
+    def lookup_facts(self, queries: List[str]) -> List[List[Dict]]:
+        """Retrieves the top car model/part facts for each query text."""
+        if self.corpus is None or not queries:
+            return [[] for _ in queries]
+        return self.corpus.lookup(self.matcher.embed(queries), config.CORPUS_TOP_K, config.CORPUS_MIN_SCORE)
+
+    def batching_stats(self) -> dict:
+        """Returns queue-depth and batch-size metrics of each batcher."""
+        return {
+            batcher.name: batcher.stats()
+            for batcher in (self.detection_batcher, self.caption_batcher)
+            if batcher is not None
+        }
+
+# Create a single, global instance of the model manager. With a model server
+# configured, this process holds a client to the server's models instead.
+if config.MODEL_SERVER_ADDRESS:
+    from models.remote import RemoteModelManager
+    models = RemoteModelManager(config.MODEL_SERVER_ADDRESS, config.MODEL_SERVER_AUTHKEY)
+else:
+    models = ModelManager()
@@ -0,0 +1,295 @@
+# file: models/remote.py
+
+"""
+Model-server mode: one process owns the loaded ModelManager and every uvicorn
+worker talks to it over a local socket, so adding workers doesn't add copies
+of the models.
+
+Images travel through shared memory: the client writes the decoded RGB pixels
+into a SharedMemory block and only sends its name and shape over the socket.
+
+Run the server with:
+    MODEL_SERVER_ADDRESS=/tmp/captioner-models.sock python -m models.remote
+and start the API workers with the same MODEL_SERVER_ADDRESS. A host:port
+address also needs the same secret MODEL_SERVER_AUTHKEY on both sides.
+"""
+
+import argparse
+import os
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker
+from multiprocessing.managers import BaseManager
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+import config
+from logic.planner import DetectionPlanner
+
+ImageSpec = Tuple[str, Tuple[int, ...]]
+
+
+def _parse_address(address: str):
+    """A "host:port" string becomes a TCP address; anything else is a unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def _check_authkey(address, authkey: bytes):
+    """Refuses a TCP address with the well-known default key: anyone reaching the port could run code here."""
+    if not isinstance(address, str) and authkey == config.DEFAULT_MODEL_SERVER_AUTHKEY:
+        raise ValueError("A host:port model server needs a secret MODEL_SERVER_AUTHKEY; "
+                         "the default key is only accepted for a unix socket.")
+
+
+@contextmanager
+def _shared_images(images: List[Image.Image]) -> Iterator[List[ImageSpec]]:
+    """Copies images into shared memory blocks that live for the duration of the call."""
+    blocks, specs = [], []
+    try:
+        for image in images:
+            array = np.asarray(image.convert("RGB"))
+            shm = SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf)[:] = array
+            blocks.append(shm)
+            specs.append((shm.name, array.shape))
+        yield specs
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+
+def _image_from_shm(spec: ImageSpec) -> Image.Image:
+    """Attaches to a client's shared memory block and copies the pixels into a PIL image."""
+    name, shape = spec
+    shm = SharedMemory(name=name)
+    try:
+        # The client owns (and unlinks) the block; don't let this process's tracker touch it.
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return Image.fromarray(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf).copy())
+    finally:
+        shm.close()
+
+
+class ModelService:
+    """The methods the model server exposes to HTTP workers."""
+    def __init__(self, manager, vehicle_parts_vocab):
+        self.manager = manager
+        self.vocab = vehicle_parts_vocab
+
+    def detect(self, spec: ImageSpec, plan=None) -> List[Dict]:
+        return self.manager.detection_batcher((_image_from_shm(spec), plan))
+
+    def detect_batch(self, specs: List[ImageSpec], plans: List) -> List[List[Dict]]:
+        # Through the batchers, so each model only ever runs on its batcher thread
+        return self.manager.detection_batcher.map([(_image_from_shm(spec), plan) for spec, plan in zip(specs, plans)])
+
+    def label_map(self) -> Dict:
+        return self.manager.detector.label_map()
+
+    def caption(self, spec: ImageSpec) -> str:
+        return self.manager.caption_batcher(_image_from_shm(spec))
+
+    def caption_batch(self, specs: List[ImageSpec]) -> List[str]:
+        return self.manager.caption_batcher.map([_image_from_shm(spec) for spec in specs])
+
+    def extract_keywords(self, text_prompt: str) -> List[str]:
+        return self.manager.matcher.extract_keywords(text_prompt, self.vocab)
+
+    def find_best_match(self, keywords: List[str], detected_objects: List[Dict]):
+        return self.manager.matcher.find_best_match(keywords, detected_objects)
+
+    def rank_matches(self, keywords_per_query, detections_per_query, top_k: int = 1):
+        return self.manager.matcher.rank_matches(keywords_per_query, detections_per_query, top_k=top_k)
+
+    def lookup_facts(self, queries: List[str]) -> List[List[Dict]]:
+        return self.manager.lookup_facts(queries)
+
+    def startup_report(self) -> Dict:
+        return self.manager.startup_report()
+
+    def batching_stats(self) -> Dict:
+        return self.manager.batching_stats()
+
+
+class _ServiceManager(BaseManager):
+    pass
+
+
+# --- Client side: objects mimicking ModelManager's attributes for the pipeline ---
+
+class _RemoteDetector:
+    def __init__(self, service):
+        self._service = service
+        self._label_map = None
+
+    def label_map(self) -> Dict:
+        if self._label_map is None:
+            self._label_map = self._service.label_map()
+        return self._label_map
+
+    def detect_objects(self, image: Image.Image, plan=None) -> List[Dict]:
+        with _shared_images([image]) as specs:
+            return self._service.detect(specs[0], plan)
+
+    def detect_objects_batch(self, images: List[Image.Image], plan=None) -> List[List[Dict]]:
+        return self.detect_items([(image, plan) for image in images])
+
+    def detect_items(self, items: List[Tuple]) -> List[List[Dict]]:
+        """Detects (image, plan) pairs in one round trip."""
+        with _shared_images([image for image, _ in items]) as specs:
+            return self._service.detect_batch(specs, [plan for _, plan in items])
+
+
+class _RemoteCaptioner:
+    def __init__(self, service):
+        self._service = service
+
+    def generate(self, image_object: Image.Image) -> str:
+        with _shared_images([image_object]) as specs:
+            return self._service.caption(specs[0])
+
+    def generate_batch(self, image_objects: List[Image.Image]) -> List[str]:
+        with _shared_images(image_objects) as specs:
+            return self._service.caption_batch(specs)
+
+    def generate_stream(self, image_object: Image.Image) -> Iterator[str]:
+        # Token streaming doesn't cross the process boundary; send the caption in one piece.
+        yield self.generate(image_object)
+
+
+class _RemoteBatcher:
+    """Stands in for a MicroBatcher: the server batches across all workers, so calls are forwarded as they come."""
+    def __init__(self, call: Callable, call_many: Callable):
+        self._call = call
+        self._call_many = call_many
+
+    def __call__(self, item):
+        return self._call(item)
+
+    def map(self, items: List) -> List:
+        return self._call_many(items) if items else []
+
+
+class _RemoteMatcher:
+    def __init__(self, service):
+        self._service = service
+
+    def extract_keywords(self, text_prompt: str, vocabulary=None) -> List[str]:
+        # The server extracts keywords with its own copy of the phrase index.
+        return self._service.extract_keywords(text_prompt)
+
+    def find_best_match(self, keywords: List[str], detected_objects: List[Dict]):
+        return self._service.find_best_match(keywords, detected_objects)
+
+    def rank_matches(self, keywords_per_query, detections_per_query, top_k: int = 1):
+        return self._service.rank_matches(keywords_per_query, detections_per_query, top_k)
+
+
+class RemoteModelManager:
+    """Drop-in replacement for ModelManager that forwards every call to the model server."""
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self.detector = None
+        self.captioner = None
+        self.matcher = None
+        self.detection_batcher = None
+        self.caption_batcher = None
+        self.planner = None
+        self.ready = False
+        self.error = None
+        self._service = None
+
+    def load_all(self, retry_s: float = 1.0):
+        """Connects to the model server, waiting until it is up and its models are ready."""
+        print(f"--- Connecting to model server at {self.address}... ---")
+        deadline = time.monotonic() + config.STARTUP_TIMEOUT_S
+        while True:
+            try:
+                manager = _ServiceManager(address=_parse_address(self.address), authkey=self.authkey)
+                manager.connect()
+                service = manager.models()
+                if service.startup_report()["ready"]:
+                    break
+            except (ConnectionError, FileNotFoundError, EOFError):
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Model server at {self.address} was not ready within {config.STARTUP_TIMEOUT_S:.0f}s.")
+            time.sleep(retry_s)
+
+        self._service = service
+        self.detector = _RemoteDetector(service)
+        self.captioner = _RemoteCaptioner(service)
+        self.matcher = _RemoteMatcher(service)
+        if config.DETECTION_PLANNING:
+            self.planner = DetectionPlanner(self.detector.label_map(), cascade=config.DETECTOR_CASCADE)
+        self.detection_batcher = _RemoteBatcher(lambda item: self.detector.detect_objects(*item), self.detector.detect_items)
+        self.caption_batcher = _RemoteBatcher(self.captioner.generate, self.captioner.generate_batch)
+        self.ready = True
+        print("--- ✅ Connected to model server. API is ready. ---")
+
+    def load_all_in_background(self) -> threading.Thread:
+        def run():
+            try:
+                self.load_all()
+            except Exception as e:
+                self.error = str(e)
+                print(f"❌ Could not connect to model server: {e}")
+
+        thread = threading.Thread(target=run, name="model-server-connect", daemon=True)
+        thread.start()
+        return thread
+
+    def startup_report(self) -> Dict:
+        if self._service is None:
+            return {"ready": False, "error": self.error, "model_server": self.address}
+        report = self._service.startup_report()
+        report["model_server"] = self.address
+        return report
+
+    def lookup_facts(self, queries: List[str]) -> List[List[Dict]]:
+        return self._service.lookup_facts(queries)
+
+    def batching_stats(self) -> Dict:
+        return self._service.batching_stats() if self._service is not None else {}
+
+
+def serve(address: str, authkey: bytes):
+    """Loads the models once and serves them to HTTP workers until interrupted."""
+    from models.loader import ModelManager
+    from utils import load_phrase_index
+
+    manager = ModelManager()
+    service = ModelService(manager, load_phrase_index("vehicle_parts_2.json"))
+    _ServiceManager.register("models", callable=lambda: service)
+
+    parsed = _parse_address(address)
+    _check_authkey(parsed, authkey)
+    # Accept connections right away so workers can poll readiness while models load
+    manager.load_all_in_background()
+    if isinstance(parsed, str) and os.path.exists(parsed):
+        os.unlink(parsed)  # stale socket from a previous run
+    server = _ServiceManager(address=parsed, authkey=authkey).get_server()
+    if isinstance(parsed, str):
+        os.chmod(parsed, 0o600)
+    print(f"🚀 Model server listening on {address}")
+    server.serve_forever()
+
+
+_ServiceManager.register("models")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the loaded models to API workers over a local socket.")
+    parser.add_argument("--address", type=str, default=config.MODEL_SERVER_ADDRESS or "/tmp/captioner-models.sock",
+                        help="Unix socket path or host:port to listen on.")
+    args = parser.parse_args()
+
+    serve(args.address, config.MODEL_SERVER_AUTHKEY)
@@ -0,0 +1,119 @@
+# file: models/stub.py
+
+"""
+Lightweight stand-ins for the detector, captioner and sentence-transformer
+encoder, selected with MODELS_STUB=1. They need no weights, GPU, torch or
+ultralytics, return deterministic results for the same image, and can sleep
+to simulate model latency. Benchmarks and load tests use them to measure the
+pipeline and server overhead on any CPU box.
+"""
+
+import hashlib
+import random
+import time
+import zlib
+from typing import Dict, Iterator, List
+
+import numpy as np
+from PIL import Image
+
+from logic.planner import filter_detections
+
+# Labels the stub detector emits; each one appears in vehicle_parts_2.json.
+STUB_PART_LABELS = ["headlight", "bumper", "wheel", "door", "side mirror",
+                    "windshield", "taillight", "hood", "license plate", "tyre"]
+
+
+def _image_seed(image: Image.Image) -> int:
+    """Stable seed from a thumbnail of the pixels, so the same image gives the same result."""
+    thumbnail = image.convert("L").resize((8, 8))
+    return zlib.crc32(thumbnail.tobytes()) ^ (image.width << 16) ^ image.height
+
+
+class StubDetector:
+    """Emits one "car" box and a few part boxes inside it."""
+    def __init__(self, latency_ms: float = 0.0, max_parts: int = 4):
+        self.latency_s = latency_ms / 1000.0
+        self.max_parts = max_parts
+        print(f"✅ Stub detector ready (simulated latency {latency_ms:.0f} ms per batch).")
+
+    def label_names(self) -> List[str]:
+        return ["car"] + STUB_PART_LABELS
+
+    def label_map(self) -> Dict[str, Dict[int, str]]:
+        return {"general": {2: "car"}, "parts": dict(enumerate(STUB_PART_LABELS))}
+
+    def detect_objects(self, image: Image.Image, plan=None) -> List[Dict]:
+        return self.detect_objects_batch([image], plan=plan)[0]
+
+    def detect_objects_batch(self, images: List[Image.Image], plan=None) -> List[List[Dict]]:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        batch_detections = []
+        for image in images:
+            rng = random.Random(_image_seed(image))
+            width, height = image.size
+            x1, y1 = rng.uniform(0, 0.2) * width, rng.uniform(0, 0.2) * height
+            x2, y2 = rng.uniform(0.8, 1.0) * width, rng.uniform(0.8, 1.0) * height
+            detections = [{"box": [x1, y1, x2, y2], "label": "car", "confidence": round(rng.uniform(0.7, 0.99), 4)}]
+            for label in rng.sample(STUB_PART_LABELS, rng.randint(1, self.max_parts)):
+                px1 = rng.uniform(x1, x1 + 0.7 * (x2 - x1))
+                py1 = rng.uniform(y1, y1 + 0.7 * (y2 - y1))
+                px2 = min(x2, px1 + rng.uniform(0.1, 0.3) * (x2 - x1))
+                py2 = min(y2, py1 + rng.uniform(0.1, 0.3) * (y2 - y1))
+                detections.append({"box": [px1, py1, px2, py2], "label": label,
+                                   "confidence": round(rng.uniform(0.3, 0.95), 4)})
+            batch_detections.append(filter_detections(detections, plan, self.label_map()) if plan else detections)
+        return batch_detections
+
+
+class StubCaptioner:
+    """Returns a caption derived from the crop's pixels."""
+    ADJECTIVES = ["red", "silver", "black", "white", "blue", "dusty", "shiny", "scratched"]
+    NOUNS = ["car part", "panel", "light", "wheel", "bumper", "mirror"]
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_s = latency_ms / 1000.0
+        print(f"✅ Stub captioner ready (simulated latency {latency_ms:.0f} ms per batch).")
+
+    def _caption(self, image: Image.Image) -> str:
+        rng = random.Random(_image_seed(image))
+        return f"a {rng.choice(self.ADJECTIVES)} {rng.choice(self.NOUNS)} on a vehicle"
+
+    def generate(self, image_object: Image.Image) -> str:
+        return self.generate_batch([image_object])[0]
+
+    def generate_batch(self, image_objects: List[Image.Image]) -> List[str]:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return [self._caption(image) for image in image_objects]
+
+    def generate_stream(self, image_object: Image.Image) -> Iterator[str]:
+        words = self.generate(image_object).split(" ")
+        for i, word in enumerate(words):
+            yield word if i == 0 else " " + word
+
+
+class HashingEncoder:
+    """
+    A SentenceTransformer stand-in: hashed character-trigram vectors. Similar
+    spellings get similar vectors, which is enough for SemanticMatcher to pick
+    the part a prompt names.
+    """
+    def __init__(self, dimension: int = 256):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts: List[str], convert_to_numpy: bool = True, normalize_embeddings: bool = True) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            padded = f"  {text.lower()} "
+            for i in range(len(padded) - 2):
+                digest = hashlib.blake2b(padded[i:i + 3].encode("utf-8"), digest_size=4).digest()
+                vectors[row, int.from_bytes(digest, "little") % self.dimension] += 1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.maximum(norms, 1e-12)
+        return vectors
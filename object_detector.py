@@ -1,16 +1,47 @@
 # file: object_detector.py (Updated for the Two-Model Pipeline)
 
+from concurrent.futures import ThreadPoolExecutor
+import logging
 from ultralytics import YOLO
 from PIL import Image
-from typing import List, Dict
+from typing import List, Dict, Tuple
+import numpy as np
+import torch
+from torchvision.ops import batched_nms
+
+from logic.metrics import span
+from logic.planner import DetectionPlan
+
+logger = logging.getLogger(__name__)
+
+# COCO class ids kept from the general model (2 = car)
+GENERAL_CLASSES = [2]
 
 class ObjectDetector:
-    def __init__(self, general_model_name: str, parts_model_path: str):
+    def __init__(self, general_model_name: str, parts_model_path: str,
+                 cascade: bool = False, cascade_imgsz: int = 320, roi_padding: float = 0.05,
+                 imgsz: int = 640, nms_iou: float = 0.6):
         """
         Initializes the detector by loading TWO models:
         1. A general model to find whole vehicles.
         2. fine-tuned model to find specific parts.
+
+        In cascade mode the parts model only runs on the (padded) vehicle boxes
+        found by the general model, at `cascade_imgsz`, and not at all when no
+        vehicle is found.
+
+        Frames are letterboxed once to `imgsz` (a multiple of 32) and shared by
+        both models; `nms_iou` is the overlap above which same-label boxes from
+        either model are merged.
         """
+        self.cascade = cascade
+        self.cascade_imgsz = cascade_imgsz
+        self.roi_padding = roi_padding
+        self.imgsz = imgsz
+        self.nms_iou = nms_iou
+        # Runs the two models side by side on the shared input tensor
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="yolo")
+
         print(f"Loading general detection model: {general_model_name}...")
         self.general_model = YOLO(general_model_name)
         print("✅ General model loaded.")
@@ -19,42 +50,196 @@ class ObjectDetector:
         self.parts_model = YOLO(parts_model_path)
         print("✅ Fine-tuned parts model loaded.")
 
-    def _extract_detections(self, results) -> List[Dict]:
-        """Helper function to extract object data from a YOLO results object."""
-        detected_objects = []
-        if results[0].boxes:
-            for box in results[0].boxes:
-                detected_class = results[0].names[int(box.cls)].lower()
-                detected_objects.append({
-                    "box": box.xyxy[0].tolist(),
-                    "label": detected_class,
-                    "confidence": box.conf[0].item()
-                })
-        return detected_objects
-
-    def detect_objects(self, image: Image.Image) -> List[Dict]:
+    def label_names(self) -> List[str]:
+        """Returns every label the two models can emit (the closed label space)."""
+        labels = [self.general_model.names[cls].lower() for cls in GENERAL_CLASSES]
+        labels.extend(name.lower() for name in self.parts_model.names.values())
+        return labels
+
+    def label_map(self) -> Dict[str, Dict[int, str]]:
+        """Returns the class ids and labels of each model, for the detection planner."""
+        return {
+            "general": {cls: self.general_model.names[cls].lower() for cls in GENERAL_CLASSES},
+            "parts": {cls: name.lower() for cls, name in self.parts_model.names.items()},
+        }
+
+    def _extract_detections(self, result, offset: Tuple[float, float] = (0.0, 0.0),
+                            transform: np.ndarray | None = None) -> Dict[str, np.ndarray]:
+        """Helper function to extract object data from a single YOLO result as arrays.
+        `offset` shifts boxes found in a crop back to full-image coordinates;
+        `transform` (scale, pad_x, pad_y) undoes the shared letterboxing."""
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            return _empty_detections()
+        xyxy = boxes.xyxy.cpu().numpy().astype(np.float32)
+        if transform is not None:
+            scale, pad_x, pad_y = transform
+            xyxy = (xyxy - np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)) / scale
+        xyxy += np.array([offset[0], offset[1], offset[0], offset[1]], dtype=np.float32)
+
+        names = np.array([result.names[i].lower() for i in range(len(result.names))], dtype=object)
+        return {
+            "boxes": xyxy,
+            "labels": names[boxes.cls.cpu().numpy().astype(np.int64)],
+            "confidences": boxes.conf.cpu().numpy().astype(np.float32),
+        }
+
+    def _preprocess(self, images: List[Image.Image]) -> Tuple[torch.Tensor, np.ndarray]:
+        """
+        Letterboxes and normalizes the frames once into a BCHW float tensor that
+        both models consume directly. Returns the tensor and the per-image
+        (scale, pad_x, pad_y) needed to map boxes back.
+        """
+        size = self.imgsz
+        batch = np.full((len(images), size, size, 3), 114, dtype=np.uint8)
+        transforms = np.zeros((len(images), 3), dtype=np.float32)
+        for i, image in enumerate(images):
+            scale = min(size / image.width, size / image.height)
+            width, height = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+            pad_x, pad_y = (size - width) // 2, (size - height) // 2
+            batch[i, pad_y:pad_y + height, pad_x:pad_x + width] = np.asarray(image.resize((width, height), Image.BILINEAR))
+            transforms[i] = (scale, pad_x, pad_y)
+        tensor = torch.from_numpy(batch).permute(0, 3, 1, 2).contiguous().float().div_(255.0)
+        return tensor.to(self.general_model.device), transforms
+
+    def detect_objects(self, image: Image.Image, plan: DetectionPlan | None = None) -> List[Dict]:
         """
         Detects objects using both models and combines the results.
         """
-        all_detections = []
+        return self.detect_objects_batch([image], plan=plan)[0]
+
+    def _vehicle_rois(self, image: Image.Image, vehicles: Dict[str, np.ndarray]) -> List[Tuple[int, int, int, int]]:
+        """Pads each vehicle box and clamps it to the image bounds."""
+        rois = []
+        for x1, y1, x2, y2 in vehicles["boxes"].tolist():
+            pad_x = (x2 - x1) * self.roi_padding
+            pad_y = (y2 - y1) * self.roi_padding
+            rois.append((
+                max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y)),
+                min(image.width, int(x2 + pad_x + 1)), min(image.height, int(y2 + pad_y + 1)),
+            ))
+        return rois
+
+    def _detect_parts_in_rois(self, images: List[Image.Image], general_detections: List[Dict[str, np.ndarray]],
+                              classes: List[int] | None = None) -> List[Dict[str, np.ndarray]]:
+        """Runs the parts model on one batch holding every vehicle crop of every image."""
+        crops, owners = [], []
+        for image_index, (image, vehicles) in enumerate(zip(images, general_detections)):
+            for roi in self._vehicle_rois(image, vehicles):
+                crops.append(image.crop(roi))
+                owners.append((image_index, roi))
+
+        per_image: List[List[Dict[str, np.ndarray]]] = [[] for _ in images]
+        if not crops:
+            logger.debug("No vehicles found, skipping the parts model.")
+            return [_empty_detections() for _ in images]
+
+        logger.debug("Detecting specific car parts in %d vehicle region(s)...", len(crops))
+        with span("detect_parts"):
+            parts_results = self.parts_model.predict(crops, imgsz=self.cascade_imgsz, classes=classes, verbose=False)
+        for (image_index, roi), result in zip(owners, parts_results):
+            per_image[image_index].append(self._extract_detections(result, offset=(roi[0], roi[1])))
+        return [_concat(dets) for dets in per_image]
+
+    @staticmethod
+    def _timed_predict(stage: str, model, source, **kwargs):
+        # Runs on the detector's own pool, so the latency lands in the histogram only
+        with span(stage):
+            return model.predict(source, verbose=False, **kwargs)
+
+    def detect_objects_batch(self, images: List[Image.Image], plan: DetectionPlan | None = None) -> List[List[Dict]]:
+        """
+        Detects objects in several images and combines the results of both models.
+        The frames are preprocessed once; without cascade mode both models run
+        concurrently on the shared tensor. Returns one detection list per image.
+
+        A `plan` (see logic/planner.py) skips the model a prompt doesn't need and
+        restricts the parts model to the requested classes.
+        """
+        run_general = plan is None or plan.general or (self.cascade and plan.parts)
+        run_parts = plan is None or plan.parts
+        parts_classes = list(plan.parts_classes) if plan is not None and plan.parts_classes is not None else None
+
+        with span("detect_preprocess"):
+            tensor, transforms = self._preprocess(images)
+
+        general_future = None
+        if run_general:
+            logger.debug("Detecting general objects (like 'car') in %d image(s)...", len(images))
+            general_future = self._pool.submit(self._timed_predict, "detect_general", self.general_model,
+                                               tensor, classes=GENERAL_CLASSES)
 
-        print("🔎 Detecting general objects (like 'car')...")
-        general_results = self.general_model.predict(image, classes=[2], verbose=False)
-        general_detections = self._extract_detections(general_results)
-        all_detections.extend(general_detections)
-        
         # 2. Run detection with fine-tuned parts model
-        print("🔎 Detecting specific car parts...")
-        parts_results = self.parts_model.predict(image, verbose=False)
-        parts_detections = self._extract_detections(parts_results)
-        all_detections.extend(parts_detections)
-
-        print(f"✅ Found {len(all_detections)} total objects (car + parts).")
-        print("\n--- All Detected Objects ---")
-        if all_detections:
-            for det in all_detections:
-                print(f"   - Label: {det['label']}, Confidence: {det['confidence']:.2f}")
+        parts_future = None
+        if run_parts and not self.cascade:
+            logger.debug("Detecting specific car parts (classes: %s)...", parts_classes or "all")
+            parts_future = self._pool.submit(self._timed_predict, "detect_parts", self.parts_model,
+                                             tensor, classes=parts_classes)
+
+        if general_future is not None:
+            general_detections = [
+                self._extract_detections(result, transform=transform)
+                for result, transform in zip(general_future.result(), transforms)
+            ]
         else:
-            print("   - No objects were detected.")
-        print("--------------------------")
-        return all_detections
\ No newline at end of file
+            general_detections = [_empty_detections() for _ in images]
+        if parts_future is not None:
+            parts_detections = [
+                self._extract_detections(result, transform=transform)
+                for result, transform in zip(parts_future.result(), transforms)
+            ]
+        elif run_parts:
+            parts_detections = self._detect_parts_in_rois(images, general_detections, parts_classes)
+        else:
+            parts_detections = [_empty_detections() for _ in images]
+
+        batch_detections = []
+        for image, general, parts in zip(images, general_detections, parts_detections):
+            merged = _nms(_concat([general, parts]), self.nms_iou)
+            np.clip(merged["boxes"][:, 0::2], 0, image.width, out=merged["boxes"][:, 0::2])
+            np.clip(merged["boxes"][:, 1::2], 0, image.height, out=merged["boxes"][:, 1::2])
+            all_detections = _to_dicts(merged)
+            batch_detections.append(all_detections)
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Found %d total objects (car + parts): %s", len(all_detections),
+                             ", ".join(f"{det['label']} ({det['confidence']:.2f})" for det in all_detections) or "none")
+        return batch_detections
+
+
+def _empty_detections() -> Dict[str, np.ndarray]:
+    return {
+        "boxes": np.zeros((0, 4), dtype=np.float32),
+        "labels": np.zeros((0,), dtype=object),
+        "confidences": np.zeros((0,), dtype=np.float32),
+    }
+
+
+def _concat(detections: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    if not detections:
+        return _empty_detections()
+    return {key: np.concatenate([det[key] for det in detections]) for key in ("boxes", "labels", "confidences")}
+
+
+def _nms(detections: Dict[str, np.ndarray], iou_threshold: float) -> Dict[str, np.ndarray]:
+    """Label-aware NMS across both models' detections, sorted by confidence."""
+    if len(detections["confidences"]) == 0:
+        return detections
+    _, label_ids = np.unique(detections["labels"].astype(str), return_inverse=True)
+    keep = batched_nms(
+        torch.from_numpy(detections["boxes"]),
+        torch.from_numpy(detections["confidences"]),
+        torch.from_numpy(label_ids.astype(np.int64)),
+        iou_threshold,
+    ).numpy()
+    return {key: value[keep] for key, value in detections.items()}
+
+
+def _to_dicts(detections: Dict[str, np.ndarray]) -> List[Dict]:
+    """Converts detection arrays into the list-of-dicts format used by the pipeline."""
+    return [
+        {"box": box, "label": str(label), "confidence": confidence}
+        for box, label, confidence in zip(
+            detections["boxes"].tolist(), detections["labels"].tolist(), detections["confidences"].tolist()
+        )
+    ]
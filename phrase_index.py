@@ -0,0 +1,115 @@
+# file: phrase_index.py
+
+import re
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+# Words keep inner hyphens so "three-wheeler" stays one token.
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+# Key under which a trie node stores the (phrase, category) ending there.
+_END = ""
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases and splits text into word tokens, dropping punctuation."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class PhraseMatch(NamedTuple):
+    phrase: str
+    category: str
+    start: int  # token offset of the first word
+    end: int    # token offset one past the last word
+
+
+class PhraseIndex:
+    """
+    A word-level trie over the vocabulary phrases of vehicle_parts_2.json.
+
+    Every synonym (and every category key itself) maps back to its canonical
+    category. extract() does greedy longest-match scanning, so its cost depends
+    on the prompt length, not on the vocabulary size.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self):
+        self._root: Dict = {}
+        self._categories: Dict[str, str] = {}
+        self.max_phrase_length = 0
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Iterable[str]]) -> "PhraseIndex":
+        """Builds the index from a {category: [synonyms, ...]} mapping."""
+        index = cls()
+        for category, phrases in data.items():
+            index.add(category, category)
+            for phrase in phrases:
+                index.add(phrase, category)
+        return index
+
+    def add(self, phrase: str, category: str):
+        """Adds a phrase. The first category a phrase is seen under wins."""
+        tokens = tokenize(phrase)
+        if not tokens:
+            return
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        if _END not in node:
+            canonical = " ".join(tokens)
+            node[_END] = (canonical, category.lower())
+            self._categories[canonical] = category.lower()
+            self.max_phrase_length = max(self.max_phrase_length, len(tokens))
+
+    def extract(self, text: str) -> List[PhraseMatch]:
+        """Returns the non-overlapping, longest vocabulary phrases found in `text`."""
+        tokens = tokenize(text)
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node = self._root
+            best: Tuple[int, Tuple[str, str]] | None = None
+            j = i
+            while j < len(tokens) and tokens[j] in node:
+                node = node[tokens[j]]
+                j += 1
+                if _END in node:
+                    best = (j, node[_END])
+            if best is None:
+                i += 1
+                continue
+            end, (phrase, category) = best
+            matches.append(PhraseMatch(phrase, category, i, end))
+            i = end
+        return matches
+
+    def category_of(self, phrase: str) -> str | None:
+        """Returns the canonical category of a vocabulary phrase."""
+        return self._categories.get(" ".join(tokenize(phrase)))
+
+    def categories(self) -> Dict[str, List[str]]:
+        """Returns {category: [phrases, ...]} for every indexed phrase."""
+        grouped: Dict[str, List[str]] = {}
+        for phrase, category in self._categories.items():
+            grouped.setdefault(category, []).append(phrase)
+        return grouped
+
+    def __contains__(self, phrase: str) -> bool:
+        return " ".join(tokenize(phrase)) in self._categories
+
+    def __iter__(self):
+        return iter(self._categories)
+
+    def __len__(self) -> int:
+        return len(self._categories)
+
+    def __getstate__(self):
+        return {"version": self.FORMAT_VERSION, "root": self._root,
+                "categories": self._categories, "max_phrase_length": self.max_phrase_length}
+
+    def __setstate__(self, state):
+        if state.get("version") != self.FORMAT_VERSION:
+            raise ValueError(f"Unsupported phrase index format: {state.get('version')}")
+        self._root = state["root"]
+        self._categories = state["categories"]
+        self.max_phrase_length = state["max_phrase_length"]
@@ -1,69 +1,102 @@
 # run_caption.py
 
-import torch
-from PIL import Image
-from transformers import AutoProcessor, BlipForConditionalGeneration, BitsAndBytesConfig
-from peft import PeftModel
+import argparse
 import os
 
+from PIL import Image
+
 # --- Configuration ---
 # 1. Path to your fine-tuned adapter model (the folder you downloaded)
-PEFT_MODEL_PATH = "./blip-finetuned-model" 
+PEFT_MODEL_PATH = "./blip-finetuned-model"
 # 2. Path to the image you want to caption
 IMAGE_PATH = "Acura_ILX.jpg" # <--- CHANGE THIS
 # 3. Original base model ID
 BASE_MODEL_ID = "Salesforce/blip-image-captioning-base"
+
+# 4. Inference backend: "auto", "4bit" (CUDA), "fp32", "int8" or "onnx" (CPU)
+BACKEND = os.getenv("CAPTION_BACKEND", "auto")
+# 5. Merged/exported model written by caption_export.py (used by the CPU backends)
+ARTIFACT_DIR = os.getenv("CAPTION_ARTIFACT_DIR", "./blip-cpu-artifact")
 # ---------------------
 
-# Check if a CUDA-enabled GPU is available
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"✅ Using device: {device}")
 
+def load_captioner(allow_stub: bool = False):
+    """Loads the caption model; bulk runs get the stub captioner with MODELS_STUB=1."""
+    import config
 
-# Load the processor from your saved folder
-processor = AutoProcessor.from_pretrained(PEFT_MODEL_PATH)
+    if allow_stub and config.MODELS_STUB:
+        from models.stub import StubCaptioner
 
-# Load the base model with 4-bit quantization
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_quant_type="nf4",
-    bnb_4bit_compute_dtype=torch.float16,
-)
+        return StubCaptioner(latency_ms=config.STUB_CAPTION_MS)
 
-base_model = BlipForConditionalGeneration.from_pretrained(
-    BASE_MODEL_ID,
-    quantization_config=bnb_config,
-    device_map={"": 0},
-    use_safetensors=True  # <-- Add this line
-)
-# Apply the LoRA adapter to the base model
-model = PeftModel.from_pretrained(base_model, PEFT_MODEL_PATH)
-model.eval() # Set the model to evaluation mode
+    from caption_generator import CaptionGenerator
+
+    captioner = CaptionGenerator(PEFT_MODEL_PATH, BASE_MODEL_ID, backend=BACKEND, artifact_dir=ARTIFACT_DIR)
+    print(f"✅ Using device: {captioner.device} ({captioner.backend})")
+    return captioner
 
-print("✅ Model and processor loaded successfully.")
 
 # --- Generate a caption ---
-def generate_caption(image_path):
+def generate_caption(captioner, image_path):
     """Loads an image and generates a caption using the fine-tuned model."""
     if not os.path.exists(image_path):
         print(f"❌ Error: Image not found at {image_path}")
         return
 
     try:
-        # Load and process the image
+        # Load the image and generate the caption with the backend's own settings
         image = Image.open(image_path).convert("RGB")
-        inputs = processor(images=image, return_tensors="pt").to(device, torch.float16)
-
-        # Generate the caption
-        generated_ids = model.generate(**inputs, max_new_tokens=50)
-        generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0].strip()
+        generated_text = captioner.generate(image)
 
         print("\n--- Caption ---")
         print(f"🤖 Generated: {generated_text}")
-        
+
     except Exception as e:
         print(f"An error occurred: {e}")
 
+
+def run_bulk_captioning(args):
+    """Captions a directory or manifest of images, resuming from the output's completed items."""
+    from logic.bulk import iter_items, open_writer, run_bulk
+
+    items = iter_items(args.input, prompt=args.prompt)
+    writer = open_writer(args.output, args.format)
+
+    if args.pipeline:
+        # Full detect -> match -> crop -> caption, with the server's models and vocabulary
+        from models.loader import models
+        from utils import load_phrase_index
+
+        models.load_all()
+        vocab = load_phrase_index("vehicle_parts_2.json")
+        return run_bulk(items, writer, vocab=vocab, top_k=args.top_k, batch_size=args.batch_size,
+                        workers=args.workers, prefetch=args.prefetch)
+
+    captioner = load_captioner(allow_stub=True)
+    return run_bulk(items, writer, captioner=captioner, batch_size=args.batch_size, workers=args.workers,
+                    prefetch=args.prefetch, processor_path=getattr(captioner, "processor_path", None))
+
+
 # Run the generation
 if __name__ == "__main__":
-    generate_caption(IMAGE_PATH)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Caption one image, or a directory/manifest of images in bulk.")
+    parser.add_argument("image", nargs="?", default=IMAGE_PATH, help="Image to caption (single-image mode).")
+    parser.add_argument("--input", type=str, default=None,
+                        help="Bulk mode: a directory of images, a .jsonl manifest ({\"path\", \"id\", \"prompt\"}) or a file of paths.")
+    parser.add_argument("--output", type=str, default="captions.jsonl",
+                        help="Bulk results: a .jsonl file, or a directory of Parquet parts (e.g. captions.parquet).")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default=None, help="Output format (default: by extension).")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Caption the objects matching each prompt (detect -> match -> crop) instead of whole images.")
+    parser.add_argument("--prompt", type=str, default=None, help="Prompt for items whose manifest entry has none.")
+    parser.add_argument("--top-k", type=int, default=1, help="Matches captioned per image in pipeline mode.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per generate call.")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Decode/preprocess processes.")
+    parser.add_argument("--prefetch", type=int, default=64, help="Images decoded ahead of the model.")
+    args = parser.parse_args()
+
+    if args.input:
+        run_bulk_captioning(args)
+    else:
+        generate_caption(load_captioner(), args.image)
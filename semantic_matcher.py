@@ -1,20 +1,173 @@
 # file: semantic_matcher.py
-import torch 
-from sentence_transformers import SentenceTransformer, util
-from typing import List, Dict
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from phrase_index import PhraseIndex, PhraseMatch, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Prompt words that never start or end an out-of-vocabulary n-gram worth snapping.
+PROMPT_STOPWORDS = frozenset({
+    "a", "an", "the", "of", "on", "in", "at", "to", "for", "with", "and", "or", "is", "are", "was", "be",
+    "this", "that", "these", "those", "it", "its", "my", "your", "me", "i", "you", "what", "which", "where",
+    "how", "can", "could", "please", "show", "find", "describe", "caption", "tell", "about", "there",
+})
 
 class SemanticMatcher:
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        """Initializes the matcher by loading the sentence transformer model."""
-        print(f"Loading semantic matching model: {model_name}...")
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name='all-MiniLM-L6-v2', keyword_cache_size: int = 4096, model=None):
+        """
+        Initializes the matcher by loading the sentence transformer model.
+        A preloaded `model` with the same encode() interface can be passed instead.
+        """
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+
+            print(f"Loading semantic matching model: {model_name}...")
+            model = SentenceTransformer(model_name)
+        self.model = model
+        self.keyword_cache_size = keyword_cache_size
+
+        # Closed label space of the detectors, embedded once and L2-normalized
+        self._label_rows: Dict[str, int] = {}
+        self._label_matrix = np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        self._label_lock = threading.Lock()
+
+        # LRU cache of keyword embeddings
+        self._keyword_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._keyword_lock = threading.Lock()
+
+        # Precomputed vocabulary phrase embeddings for out-of-vocabulary prompts (see set_vocabulary_store)
+        self.vocabulary_store = None
+        self.snap_threshold = 0.65
+        self.snap_max_ngram = 3
         print("✅ Semantic matcher loaded successfully.")
 
-    def extract_keywords(self, text_prompt: str, vocabulary: set) -> List[str]:
-        """Extracts known keywords from a text prompt."""
-        prompt_words = set(text_prompt.lower().split())
-        keywords = [word for word in vocabulary if word in prompt_words]
-        print(f"   - Extracted keywords from prompt: {keywords}")
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encodes texts into L2-normalized float32 vectors (cosine == dot product)."""
+        return self.model.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32)
+
+    def build_label_index(self, labels: Iterable[str]):
+        """Precomputes the embeddings of every label the detectors can emit."""
+        new_labels = sorted({label.lower() for label in labels} - set(self._label_rows))
+        if not new_labels:
+            return
+        embeddings = self._encode(new_labels)
+        with self._label_lock:
+            offset = len(self._label_matrix)
+            self._label_matrix = np.vstack([self._label_matrix, embeddings])
+            for i, label in enumerate(new_labels):
+                self._label_rows[label] = offset + i
+        # Also runs on the request path when a label wasn't seen at startup
+        logger.debug("Indexed %d detector labels for matching.", len(self._label_rows))
+
+    def _label_embeddings(self, labels: List[str]) -> np.ndarray:
+        """Looks up label vectors, indexing any label that wasn't seen at startup."""
+        missing = [label for label in labels if label not in self._label_rows]
+        if missing:
+            self.build_label_index(missing)
+        rows = [self._label_rows[label] for label in labels]
+        return self._label_matrix[rows]
+
+    def _keyword_embeddings(self, keywords: List[str]) -> np.ndarray:
+        """Returns keyword vectors, encoding only the cache misses in one call."""
+        with self._keyword_lock:
+            missing = [kw for kw in dict.fromkeys(keywords) if kw not in self._keyword_cache]
+        if missing:
+            embeddings = self._encode(missing)
+            with self._keyword_lock:
+                for kw, emb in zip(missing, embeddings):
+                    self._keyword_cache[kw] = emb
+                while len(self._keyword_cache) > self.keyword_cache_size:
+                    self._keyword_cache.popitem(last=False)
+        with self._keyword_lock:
+            vectors = []
+            for kw in keywords:
+                emb = self._keyword_cache.get(kw)
+                if emb is None:
+                    # Evicted by a concurrent caller between the two lock sections
+                    emb = self._encode([kw])[0]
+                else:
+                    self._keyword_cache.move_to_end(kw)
+                vectors.append(emb)
+        return np.stack(vectors)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Returns L2-normalized vectors for arbitrary texts (e.g. retrieval queries), through the keyword cache."""
+        return self._keyword_embeddings(texts)
+
+    def set_vocabulary_store(self, store, threshold: float = 0.65, max_ngram: int = 3):
+        """Enables snapping out-of-vocabulary prompt n-grams to the nearest phrases of `store`."""
+        self.vocabulary_store = store
+        self.snap_threshold = threshold
+        self.snap_max_ngram = max_ngram
+
+    def snap_to_vocabulary(self, text_prompt: str, vocabulary: PhraseIndex,
+                           exact_matches: List[PhraseMatch] | None = None) -> List[str]:
+        """
+        Combines the prompt's exact vocabulary matches with snapped n-grams.
+
+        N-grams the exact matches don't already spell out (e.g. "head lamp",
+        "front light") are mapped to their nearest vocabulary phrases in one
+        batched similarity search. The best non-overlapping snaps above the
+        threshold fill the words no exact match covers. A multi-word snap also
+        replaces the single-word exact hits inside it ("head lamp" is the
+        headlamp, not the cylinder "head"). Keywords come back in prompt order.
+        """
+        if exact_matches is None:
+            exact_matches = vocabulary.extract(text_prompt)
+        selected = [(match.start, match.end, match.phrase, True) for match in exact_matches]
+        if self.vocabulary_store is None:
+            return list(dict.fromkeys(phrase for _, _, phrase, _ in selected))
+
+        tokens = tokenize(text_prompt)
+        exact_spans = {(start, end) for start, end, _, _ in selected}
+        candidates = [
+            (start, start + n, " ".join(tokens[start:start + n]))
+            for start in range(len(tokens))
+            for n in range(1, self.snap_max_ngram + 1)
+            if start + n <= len(tokens) and (start, start + n) not in exact_spans
+            and tokens[start] not in PROMPT_STOPWORDS and tokens[start + n - 1] not in PROMPT_STOPWORDS
+        ]
+        if candidates:
+            nearest = self.vocabulary_store.search(self.embed([text for _, _, text in candidates]),
+                                                   top_k=1, threshold=self.snap_threshold)
+            scored = sorted(
+                ((matches[0][1], start, end, self.vocabulary_store.keys[matches[0][0]])
+                 for (start, end, _), matches in zip(candidates, nearest) if matches),
+                reverse=True,
+            )
+            for score, start, end, phrase in scored:
+                # Skip phrases a stale store has that the served vocabulary lacks, and
+                # phrases longer than the n-gram ("rear wheel" is not "rear wheel drive")
+                if phrase not in vocabulary or len(tokenize(phrase)) > end - start:
+                    continue
+                overlapping = [entry for entry in selected if entry[0] < end and start < entry[1]]
+                replaceable = end - start > 1 and all(
+                    is_exact and entry_end - entry_start == 1 and entry_phrase != phrase
+                    for entry_start, entry_end, entry_phrase, is_exact in overlapping
+                )
+                if overlapping and not replaceable:
+                    continue
+                selected = [entry for entry in selected if entry not in overlapping] + [(start, end, phrase, False)]
+                logger.debug("Snapped '%s' to vocabulary phrase '%s' (%.3f)", " ".join(tokens[start:end]), phrase, score)
+        return list(dict.fromkeys(phrase for _, _, phrase, _ in sorted(selected)))
+
+    def extract_keywords(self, text_prompt: str, vocabulary: PhraseIndex | set) -> List[str]:
+        """
+        Extracts known keywords (including multi-word phrases) from a text prompt.
+        With a vocabulary store loaded, words without an exact match are
+        snapped to their nearest vocabulary phrases as well.
+        """
+        if isinstance(vocabulary, PhraseIndex):
+            keywords = self.snap_to_vocabulary(text_prompt, vocabulary)
+        else:
+            prompt_words = set(text_prompt.lower().split())
+            keywords = [word for word in vocabulary if word in prompt_words]
+        logger.debug("Extracted keywords from prompt: %s", keywords)
         return keywords
 
     def find_best_match(self, keywords: List[str], detected_objects: List[Dict]) -> Dict | None:
@@ -25,25 +178,57 @@ class SemanticMatcher:
         detected_labels = [obj['label'] for obj in detected_objects]
         
         if not keywords:
-            print("   - No specific keywords found, using the entire prompt for matching.")
+            logger.debug("No specific keywords found, using the entire prompt for matching.")
             keywords = [ "car", "vehicle" ] # Default to common terms if prompt is generic
 
-        # Encode all keywords and detected labels into vectors
-        keyword_embeddings = self.model.encode(keywords, convert_to_tensor=True)
-        label_embeddings = self.model.encode(detected_labels, convert_to_tensor=True)
+        # Look up the cached keyword vectors and the precomputed label vectors
+        keyword_embeddings = self._keyword_embeddings(keywords)
+        label_embeddings = self._label_embeddings(detected_labels)
 
-        # Calculate cosine similarity between each keyword and each detected label
-        cosine_scores = util.cos_sim(keyword_embeddings, label_embeddings)
+        # Cosine similarity between each keyword and each detected label in one matmul
+        cosine_scores = keyword_embeddings @ label_embeddings.T
 
-        average_scores = torch.mean(cosine_scores, dim=0)
-        best_match_index = torch.argmax(average_scores).item()
-        best_match_score = average_scores[best_match_index].item()
+        average_scores = cosine_scores.mean(axis=0)
+        best_match_index = int(np.argmax(average_scores))
+        best_match_score = float(average_scores[best_match_index])
         
-        print(f"   - Best match is '{detected_labels[best_match_index]}' with a similarity score of {best_match_score:.4f}")
+        logger.debug("Best match is '%s' with a similarity score of %.4f", detected_labels[best_match_index], best_match_score)
 
         # You can set a threshold to avoid non-sensical matches
         if best_match_score < 0.3: # Confidence threshold
-            print("   - Match score is below threshold. No confident match found.")
+            logger.debug("Match score is below threshold. No confident match found.")
             return None
 
-        return detected_objects[best_match_index]
\ No newline at end of file
+        return detected_objects[best_match_index]
+
+    def rank_matches(self, keywords_per_query: List[List[str]], detections_per_query: List[List[Dict]],
+                     top_k: int = 1, threshold: float = 0.3) -> List[List[Tuple[Dict, float]]]:
+        """
+        Scores many (keywords, detections) queries at once, e.g. for a batch of
+        images. All keywords and labels are looked up together and compared with
+        a single matmul. Returns, per query, up to `top_k` (detection, score)
+        pairs above `threshold`, best first.
+        """
+        queries = [keywords or ["car", "vehicle"] for keywords in keywords_per_query]
+        all_keywords = list(dict.fromkeys(kw for keywords in queries for kw in keywords))
+        all_labels = list(dict.fromkeys(obj['label'] for dets in detections_per_query for obj in dets))
+        if not all_labels:
+            return [[] for _ in queries]
+
+        keyword_rows = {kw: i for i, kw in enumerate(all_keywords)}
+        label_cols = {label: i for i, label in enumerate(all_labels)}
+        cosine_scores = self._keyword_embeddings(all_keywords) @ self._label_embeddings(all_labels).T
+
+        ranked = []
+        for keywords, detections in zip(queries, detections_per_query):
+            if not detections:
+                ranked.append([])
+                continue
+            rows = [keyword_rows[kw] for kw in keywords]
+            cols = [label_cols[obj['label']] for obj in detections]
+            average_scores = cosine_scores[np.ix_(rows, cols)].mean(axis=0)
+            order = np.argsort(-average_scores)[:top_k]
+            ranked.append([
+                (detections[i], float(average_scores[i])) for i in order if average_scores[i] >= threshold
+            ])
+        return ranked
@@ -5,7 +5,9 @@ import base64
 import io
 from PIL import Image
 import argparse
+import json
 import os
+from typing import Optional
 
 def get_content_type(file_path):
     """Determines the image content type based on the file extension."""
@@ -38,7 +40,8 @@ def test_endpoint(api_url: str, image_path: str, prompt: str):
         data = {"prompt": prompt}
         
         try:
-            response = requests.post(api_url, files=files, data=data)
+            # Ask for the images inline; the API omits them by default
+            response = requests.post(api_url, files=files, data=data, params={"artifacts": "inline"})
         except requests.exceptions.ConnectionError as e:
             print(f"\n❌ Connection Error: Could not connect to the API at {api_url}")
             print("   Please make sure your Uvicorn server is running.")
@@ -71,12 +74,96 @@ def test_endpoint(api_url: str, image_path: str, prompt: str):
         print(f"   - Detail: {response.json().get('detail', 'No details provided.')}")
 
 
+def smoke_test(image_path: Optional[str] = None, prompt: str = "the car") -> bool:
+    """
+    Runs the app in-process (FastAPI TestClient) and checks that every endpoint
+    answers for the image and prompt. Without an image it uses stub models and
+    a synthetic frame. Returns True if every check passed.
+    """
+    if image_path is None:
+        os.environ["MODELS_STUB"] = "1"
+        os.environ.setdefault("CACHE_DIR", "")
+    import time
+    from fastapi.testclient import TestClient
+    import main
+
+    if image_path is None:
+        from benchmarks.corpus import build_images
+        image_path, image_bytes = "frame.jpg", build_images(1, seed=3, size=(1280, 720))[0]
+    else:
+        with open(image_path, "rb") as image_file:
+            image_bytes = image_file.read()
+    files = lambda data=image_bytes: {"image": (os.path.basename(image_path), data, get_content_type(image_path))}
+    data = {"prompt": prompt}
+    failures = 0
+
+    def check(name: str, response, expected: int = 200):
+        nonlocal failures
+        ok = response.status_code == expected
+        failures += not ok
+        print(f"{'✅' if ok else '❌'} {name}: {response.status_code}" + ("" if ok else f" {response.text[:200]}"))
+
+    with TestClient(main.app, raise_server_exceptions=False) as client:
+        # Models load in the background; wait until the server reports ready
+        ready_by = time.monotonic() + 300
+        while client.get("/readyz").status_code != 200 and time.monotonic() < ready_by:
+            time.sleep(0.1)
+        check("/readyz", client.get("/readyz"))
+
+        for mode in ("none", "inline", "multipart", "lazy"):
+            response = client.post("/caption/", files=files(), data=data, params={"artifacts": mode})
+            check(f"/caption/?artifacts={mode}", response)
+            if mode == "lazy" and response.status_code == 200:
+                check("/artifacts/{id}", client.get(response.json()["artifacts"]["annotated"]))
+
+        check("/caption/ (undecodable upload)", client.post(
+            "/caption/", files=files(b"not an image"), data=data), expected=400)
+
+        response = client.post("/caption/batch", files=[("images", files()["image"])] * 2,
+                               data={"prompts": prompt, "top_k": "2"})
+        check("/caption/batch", response)
+        errors = [line for line in response.text.splitlines() if '"error"' in line]
+        if errors:
+            failures += 1
+            print(f"❌ /caption/batch items failed: {errors[0][:200]}")
+
+        # Bytes after the end of the image change its content hash but not its pixels,
+        # so both captions are generated afresh, and they must agree
+        response = client.post("/caption/stream", files=files(image_bytes + b"\0"), data=data)
+        check("/caption/stream", response)
+        events = [block.split("\n", 1) for block in response.text.strip().split("\n\n") if block]
+        events = [(name[len("event: "):], json.loads(body[len("data: "):])) for name, body in events]
+        streamed = "".join(body["token"] for name, body in events if name == "token")
+        expected = client.post("/caption/", files=files(image_bytes + b"\0\0"), data=data).json().get("caption")
+        if any(name == "error" for name, _ in events) or streamed != expected or events[-1][1].get("caption") != expected:
+            failures += 1
+            print(f"❌ /caption/stream text {streamed!r} differs from /caption/ {expected!r}: {response.text[:200]}")
+
+        session_id = client.post("/video/sessions", data=data).json()["session_id"]
+        for _ in range(3):
+            check("/video/sessions/{id}/frames", client.post(f"/video/sessions/{session_id}/frames", files=files()))
+        check("DELETE /video/sessions/{id}", client.delete(f"/video/sessions/{session_id}"))
+
+        check("/metrics", client.get("/metrics"))
+
+    print(f"\n{'✅ Smoke test passed.' if not failures else f'❌ {failures} smoke check(s) failed.'}")
+    return not failures
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Test the Object Captioning API.")
-    parser.add_argument("--image", type=str, required=True, help="Path to the input image file (e.g., .jpg, .png).")
-    parser.add_argument("--prompt", type=str, required=True, help="The object to detect and caption.")
+    parser.add_argument("--image", type=str, help="Path to the input image file (e.g., .jpg, .png).")
+    parser.add_argument("--prompt", type=str, help="The object to detect and caption.")
     parser.add_argument("--url", type=str, default="http://127.0.0.1:8000/caption/", help="URL of the API endpoint.")
+    parser.add_argument("--smoke", action="store_true",
+                        help="Instead of calling a running server, check every endpoint in-process "
+                             "(with stub models unless --image is given).")
     
     args = parser.parse_args()
+
+    if args.smoke:
+        raise SystemExit(0 if smoke_test(args.image, args.prompt or "the car") else 1)
+    if not (args.image and args.prompt):
+        parser.error("--image and --prompt are required unless --smoke is given.")
     
     test_endpoint(api_url=args.url, image_path=args.image, prompt=args.prompt)
\ No newline at end of file
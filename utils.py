@@ -1,6 +1,10 @@
 # file: utils.py
 
 import json
+import os
+import pickle
+
+from phrase_index import PhraseIndex
 
 def load_vehicle_parts(filepath: str) -> set:
     """
@@ -26,4 +30,45 @@ def load_vehicle_parts(filepath: str) -> set:
         return all_parts
     except Exception as e:
         print(f"❌ Error loading vehicle parts dictionary: {e}")
-        return set()
\ No newline at end of file
+        return set()
+
+def load_phrase_index(filepath: str, cache_path: str | None = None) -> PhraseIndex:
+    """
+    Loads the compiled phrase index for the vehicle parts JSON file.
+
+    The index is pickled next to the JSON file (or at `cache_path`) and reused
+    on later startups as long as it is newer than the JSON file.
+
+    Args:
+        filepath (str): The path to the vehicle_parts_2.json file.
+        cache_path (str, optional): Where to store the compiled index.
+
+    Returns:
+        PhraseIndex: The index mapping every phrase to its category.
+    """
+    cache_path = cache_path or os.path.splitext(filepath)[0] + ".index.pkl"
+    try:
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(filepath):
+            with open(cache_path, 'rb') as f:
+                index = pickle.load(f)
+            print(f"✅ Loaded compiled phrase index ({len(index)} phrases) from {cache_path}.")
+            return index
+    except Exception as e:
+        print(f"⚠️  Ignoring unreadable phrase index cache: {e}")
+
+    try:
+        with open(filepath, 'r') as f:
+            data = json.load(f)
+        index = PhraseIndex.from_dict(data)
+    except Exception as e:
+        print(f"❌ Error building phrase index: {e}")
+        return PhraseIndex()
+
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        print(f"⚠️  Could not save phrase index cache: {e}")
+
+    print(f"✅ Built phrase index with {len(index)} phrases in {len(data)} categories.")
+    return index
@@ -0,0 +1,45 @@
+# file: vocabulary_index.py
+
+import argparse
+import json
+from typing import List, Tuple
+
+from embedding_store import EmbeddingStore
+from phrase_index import PhraseIndex
+
+
+def vocabulary_rows(index: PhraseIndex) -> Tuple[List[Tuple[int, str]], List[str], List[str]]:
+    """One row per canonical vocabulary phrase; the payload is the phrase's category."""
+    keys = sorted(index)
+    rows = list(enumerate(keys))
+    return rows, keys, [index.category_of(phrase) for phrase in keys]
+
+
+def build_vocabulary_store(vocab_path: str, output_path: str, model_name: str = "all-MiniLM-L6-v2") -> EmbeddingStore:
+    """Embeds every phrase of vehicle_parts_2.json with the sentence-transformer model and saves the store."""
+    from sentence_transformers import SentenceTransformer
+
+    with open(vocab_path, "r") as f:
+        index = PhraseIndex.from_dict(json.load(f))
+    rows, keys, categories = vocabulary_rows(index)
+
+    print(f"Embedding {len(keys)} vocabulary phrases with {model_name}...")
+    model = SentenceTransformer(model_name)
+    store = EmbeddingStore.build(
+        lambda texts: model.encode(texts, convert_to_numpy=True, normalize_embeddings=True),
+        rows, keys, categories, model_name=model_name,
+    )
+    store.save(output_path)
+    print(f"✅ Saved vocabulary embeddings ({store.matrix.shape[0]} x {store.dimension}, float16) to {output_path}.*")
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the vocabulary embedding store used to snap out-of-vocabulary prompt words.")
+    parser.add_argument("--vocab", type=str, default="vehicle_parts_2.json", help="Path to the vocabulary JSON file.")
+    parser.add_argument("--output", type=str, default="./vehicle_parts_2.embeddings", help="Path prefix of the store files.")
+    parser.add_argument("--model", type=str, default="all-MiniLM-L6-v2", help="Sentence-transformer model (must match the matcher's).")
+
+    args = parser.parse_args()
+
+    build_vocabulary_store(args.vocab, args.output, args.model)